@@ -3,17 +3,24 @@ import random
 import sys
 # import pickle  # UNUSED
 import time
-from typing import List, Dict, Any
+import uuid
+import zlib
+from typing import List, Dict, Any, Iterator, Tuple
 import tempfile # To create temporary files during download
 import requests
+import numpy as np
 # --- Libraries ---
 import threading #incase 2 users press indexing at the same time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from langchain_classic.retrievers import ContextualCompressionRetriever
-from langchain_community.document_loaders import PyPDFLoader
 # LangChain & Graph
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.rate_limiters import InMemoryRateLimiter
 # from langchain_chroma import Chroma  # UNUSED - using SupabaseVectorStore instead
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -32,7 +39,6 @@ from langchain_classic.retrievers.document_compressors import CrossEncoderRerank
 
 # HuggingFaceCrossEncoder is currently most stable in 'langchain_community'
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder
-from collections import defaultdict
 
 #Supabase Imports
 from supabase import create_client, Client
@@ -73,13 +79,245 @@ CHUNK_SIZE = 800
 CHUNK_OVERLAP = 150
 TOP_K_RETRIEVAL = 15  # Fetch more for hybrid search
 TOP_K_RERANK = 5      # Final number of docs to LLM
+RERANK_MAX_CHARS = 1024  # ~256 tokens, the useful window of bge-reranker-base
+RERANK_BATCH_SIZE = 32
+RERANK_DEVICE = os.getenv("RERANK_DEVICE")  # e.g. "cpu" to opt out of the accelerator probe
+QUERY_EMBEDDING_CACHE_SIZE = 4096  # Repeated/forked questions skip the embedding round-trip
+SEMANTIC_CACHE_THRESHOLD = 0.95    # Cosine similarity at which a past answer is reused
+SEMANTIC_CACHE_PER_SPACE = 512     # Newest question/answer pairs kept per space
+# Uploads clear only this worker's entries; the TTL bounds staleness in the others
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", 300))  # seconds
+INDEX_BATCH_MAX_CHUNKS = 128       # Chunks from several uploads embedded + inserted together
+INDEX_BATCH_MAX_WAIT = 0.25        # Seconds a flush waits for other uploads to join
+CONTEXTUALIZER_RPM = int(os.getenv("CONTEXTUALIZER_RPM", 30))  # Groq free tier: 30 requests/min
+CONTEXTUALIZER_BURST = 8           # Requests allowed back-to-back before pacing kicks in
 PERSIST_DIRECTORY = "chroma_db" 
 BM25_DATA_DIR = "bm25_data"
 
+# Static instructions come first and the retrieved context last, so the leading
+# tokens are byte-identical on every turn and Groq's prefix cache can reuse them.
+# Never f-string per-query data into this template.
+SYSTEM_PROMPT = (
+    "Your name is Clark, you were created by Omar the G. You are an expert Engineering Professor and Tutor. Your goal is to help college students "
+    "deeply understand complex engineering concepts based on the provided course material.\n\n"
+
+    "INSTRUCTIONS:\n"
+    "1. **Core Accuracy**: Base your factual answer primarily on the provided CONTEXT below. "
+    "Do not contradict the context.\n"
+    "2. **Elaboration & Depth**: Do not just summarize. Expand on the concepts mentioned in the context whenever you see fit. "
+    "Explain the 'Why' and 'How' behind the theories. If the context is brief, use your internal knowledge "
+    "to provide the theoretical background.\n"
+    "3. **Examples**: Provide concrete, real-world engineering examples or analogies to illustrate the points, whenever you see fits, "
+    "even if they are not explicitly in the context.\n"
+    "4. **Structure**: Use clear formatting, bullet points, and bold text to make the answer easy to read.\n"
+    "5. **Citation**: explicitely mention what part of the answer comes from the context and what part is your own elaboration.\n\n"
+
+    "CONTEXT:\n"
+    "{context}"
+)
+
+
+class NormalizedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so every vector leaves unit-norm.
+    With unit vectors, cosine similarity equals the inner product, which is what
+    SemanticAnswerCache relies on (one matrix @ vector per lookup). The database
+    search is unaffected: match_document_chunks still ranks with cosine distance
+    (<=>), and chunks stored before this wrapper existed are not normalized.
+    """
+
+    def __init__(self, base: Embeddings):
+        self.base = base
+
+    @staticmethod
+    def _normalize(vectors) -> List[List[float]]:
+        arr = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+        arr /= np.maximum(norms, 1e-12)
+        return arr.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._normalize(self.base.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._normalize(self.base.embed_query(text))
+
+
+def _stable_chunk_key(doc: Document):
+    """Deterministic sort key so overlapping contexts produce the same token prefix."""
+    source_file = doc.metadata.get('source_document', '')
+    content = doc.metadata.get('original_content', doc.page_content)
+    return (source_file, zlib.crc32(content.encode('utf-8')))
+
+
+class TruncatingCrossEncoderReranker(CrossEncoderReranker):
+    """
+    CrossEncoderReranker that trims each chunk before scoring and runs the
+    forward pass in explicit batches. Text past the model's window is cut by
+    the tokenizer anyway, so tokenizing it is wasted CPU.
+    """
+
+    def compress_documents(self, documents, query, callbacks=None):
+        if not documents:
+            return []
+        pairs = [(query, doc.page_content[:RERANK_MAX_CHARS]) for doc in documents]
+        scores = self.model.client.predict(
+            pairs,
+            batch_size=RERANK_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        )
+        order = np.argsort(-np.asarray(scores))[: self.top_n]
+        return [documents[i] for i in order]
+
+
+def _pick_device() -> str:
+    """
+    Where the local cross-encoder runs: RERANK_DEVICE if set, else CUDA, then Apple
+    MPS, then CPU. torch comes with sentence-transformers; a broken install just
+    means CPU.
+    """
+    if RERANK_DEVICE:
+        return RERANK_DEVICE
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _chunk_ids(documents: List[Document]) -> List[str]:
+    """Stable row ids derived from the owning document id and chunk position."""
+    return [
+        str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc.metadata.get('db_id')}:{i}"))
+        for i, doc in enumerate(documents)
+    ]
+
+
+def format_context(ranked_docs: List[Document]) -> str:
+    """
+    Renders reranked chunks in a stable (source, content-hash) order.
+    The reranker position is kept as a 'rank' attribute so the LLM still knows
+    which chunk scored best.
+    """
+    ranked = [(rank, doc) for rank, doc in enumerate(ranked_docs, start=1)]
+    ranked.sort(key=lambda pair: _stable_chunk_key(pair[1]))
+
+    formatted_results = []
+    for rank, doc in ranked:
+        # Use original content if available (cleaner), otherwise use contextualized
+        content = doc.metadata.get('original_content', doc.page_content)
+        source_file = doc.metadata.get('source_document', 'Unknown')
+        formatted_results.append(f"<source doc='{source_file}' rank='{rank}'>\n{content}\n</source>")
+    return "\n\n".join(formatted_results)
+
+class SemanticAnswerCache:
+    """
+    Per-space store of (query vector -> answer) for history-free questions.
+    Vectors come from NormalizedEmbeddings (unit length), so cosine similarity is a
+    single matrix-vector product over the space's matrix.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_per_space: int = SEMANTIC_CACHE_PER_SPACE,
+                 ttl: float = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_per_space = max_per_space
+        self.ttl = ttl
+        # space_id -> (float32 matrix [n, dim], list of answer dicts, float64 expiry times [n])
+        self._spaces = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, space_id, vector: np.ndarray):
+        with self._lock:
+            entry = self._spaces.get(space_id)
+            if entry is None:
+                return None
+            matrix, answers, expires = entry
+            scores = matrix @ vector
+            scores[expires <= time.monotonic()] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return dict(answers[best])
+        return None
+
+    def add(self, space_id, vector: np.ndarray, answer: Dict[str, Any]):
+        with self._lock:
+            now = time.monotonic()
+            matrix, answers, expires = self._spaces.get(
+                space_id, (np.empty((0, vector.shape[0]), dtype=np.float32), [], np.empty(0))
+            )
+            # Expired rows go first, then the oldest beyond max_per_space
+            live = expires > now
+            matrix = np.vstack([matrix[live], vector[None, :]])[-self.max_per_space:]
+            answers = ([a for a, keep in zip(answers, live) if keep] + [dict(answer)])[-self.max_per_space:]
+            expires = np.append(expires[live], now + self.ttl)[-self.max_per_space:]
+            self._spaces[space_id] = (matrix, answers, expires)
+
+    def clear_space(self, space_id):
+        with self._lock:
+            self._spaces.pop(space_id, None)
+
+
+class IndexingCoalescer:
+    """
+    Funnels build_index calls through one worker thread that merges whatever arrives
+    within INDEX_BATCH_MAX_WAIT (up to INDEX_BATCH_MAX_CHUNKS) into a single
+    add_documents call: one embed_documents request and one upsert for the lot.
+    Callers block until their own chunks are stored, and see the batch's exception.
+    """
+
+    def __init__(self, flush, max_chunks: int = INDEX_BATCH_MAX_CHUNKS, max_wait: float = INDEX_BATCH_MAX_WAIT):
+        self._flush = flush
+        self.max_chunks = max_chunks
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="index-coalescer", daemon=True).start()
+
+    def submit(self, documents: List[Document], ids: List[str]):
+        future = Future()
+        self._queue.put((documents, ids, future))
+        future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            n_chunks = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_chunks < self.max_chunks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_chunks += len(item[0])
+
+            documents = [doc for docs, _, _ in batch for doc in docs]
+            ids = [chunk_id for _, chunk_ids, _ in batch for chunk_id in chunk_ids]
+            try:
+                self._flush(documents, ids)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    future.set_result(None)
+
+
 class AdvancedRAGSystem:
     def __init__(self):
         print("Initializing Advanced RAG System...")
         self.index_lock = threading.Lock() # Create a lock for indexing operations
+        # Small pool so vector and keyword retrieval can overlap their network waits
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
         
         # 1. Initialize Supabase Client
         self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -112,13 +350,27 @@ class AdvancedRAGSystem:
         
         # 2. Contextualizer LLM (Using Llama 3.3 again, or you can use llama-3.1-8b-instant for speed)
         # We will use 70b here too because Groq is fast enough to handle it.
+        # Contextualizer calls go out in parallel batches (DocumentProcessorService),
+        # so pace them here to stay under Groq's per-minute request limit
         self.contextualizer_llm = ChatGroq(
             model="llama-3.1-8b-instant",
-            temperature=0.0
+            temperature=0.0,
+            rate_limiter=InMemoryRateLimiter(
+                requests_per_second=CONTEXTUALIZER_RPM / 60,
+                check_every_n_seconds=0.1,
+                max_bucket_size=CONTEXTUALIZER_BURST,
+            )
         )
 
         # 2. Initialize Embeddings
-        self.embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+        self.embeddings = NormalizedEmbeddings(GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL))
+        # Query embeddings are a network call to Google; memoize them per query string.
+        # Stored as tuples so cached vectors can't be mutated by callers.
+        self._embed_query_cached = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(
+            lambda text: tuple(self.embeddings.embed_query(text))
+        )
+        # Near-duplicate questions (no history) reuse an earlier answer for the same space
+        self.semantic_cache = SemanticAnswerCache()
         
         # Initialize Vector Store (Pointer to Supabase)
         self.vectorstore = SupabaseVectorStore(
@@ -130,35 +382,81 @@ class AdvancedRAGSystem:
 
         # 3. Initialize Reranker (Cross Encoder)
         # We use a standard efficient cross-encoder from HuggingFace
-        self.reranker_model = HuggingFaceCrossEncoder(model_name="BAAI/bge-reranker-base")
-        self.compressor = CrossEncoderReranker(model=self.reranker_model, top_n=TOP_K_RERANK)
+        # It is the only model we run locally, so put it on an accelerator when there is one
+        self.backend = _pick_device()
+        self.reranker_model = HuggingFaceCrossEncoder(
+            model_name="BAAI/bge-reranker-base",
+            model_kwargs={"device": self.backend}
+        )
+        if self.backend == "cuda":
+            # fp16 halves memory traffic; reranking order is unaffected in practice
+            self.reranker_model.client.model.half()
+        print(f"Reranker running on {self.backend}")
+        self.compressor = TruncatingCrossEncoderReranker(model=self.reranker_model, top_n=TOP_K_RERANK)
 
 
         self.doc_processor = DocumentProcessorService(self.contextualizer_llm)
+        self.index_coalescer = IndexingCoalescer(self._store_chunks)
 
-        self.bm25_retrievers = {} #Dictionary to hold a separate retriever for each space
-        self.space_docs_map = defaultdict(list) #Map to store documents grouped by space for rebuilding indexes
+        # Space partitioning happens inside Postgres (match_document_chunks filters on
+        # metadata.space_id before ranking), so no per-space retrievers are kept in memory.
         print("System Initialized.")
+
+    def warm_up(self):
+        """
+        One throwaway reranker pass so torch's lazy setup (kernels, CUDA context,
+        tokenizer) happens at startup instead of on the first user's query.
+        Hosted calls (embeddings, LLM) are not pinged: they cost quota and have no
+        local cold start.
+        """
+        self.compressor.compress_documents([Document(page_content="warm-up")], "warm-up")
     
 
-    def load_and_process_pdf(self, file_url: str, db_id: int, space_id: int) -> List[Document]:
+    def load_and_process_pdf(self, file_url: str, db_id: int, space_id: int, local_path: str = None,
+                             pdf_bytes: bytes = None) -> List[Document]:
         """
         Downloads PDF from a URL (Supabase), processes it safely with Rate Limiting, and cleans up.
+        Pass local_path (on disk) or pdf_bytes (in memory) when the PDF is already here
+        to skip the download.
         """
         with self.index_lock:
-            return self.doc_processor.process_pdf(file_url, db_id, space_id)
+            return self.doc_processor.process_pdf(file_url, db_id, space_id, local_path=local_path,
+                                                  pdf_bytes=pdf_bytes)
                 
     def build_index(self, documents: List[Document]):
-        with self.index_lock:
-            print("--- Updating Partitioned Indexes ---")
-            
-            # 1. Update Supabase (Incremental)
-            # Unlike FAISS, we just add the new documents to the existing DB
-            
-            self.vectorstore.add_documents(documents)
-            print(f"Added {len(documents)} documents to Supabase vector store.")
-            
-            print("Indexing Complete.")
+        print("--- Updating Partitioned Indexes ---")
+
+        # 1. Update Supabase (Incremental)
+        # Unlike FAISS, we just add the new documents to the existing DB.
+        # Deterministic ids turn a retried/partial build into an upsert of the
+        # same rows instead of a second copy of every chunk. Ids are taken per upload,
+        # before the coalescer merges this batch with others.
+        # No index_lock here: upserts are independent, so the next upload's PDF
+        # processing can overlap this one's embedding + insert.
+        self._delete_document_chunks({doc.metadata.get('db_id') for doc in documents})
+        self.index_coalescer.submit(documents, _chunk_ids(documents))
+        print(f"Added {len(documents)} documents to Supabase vector store.")
+
+        # Cached answers for these spaces predate the new material
+        for space_id in {doc.metadata.get('space_id') for doc in documents}:
+            self.semantic_cache.clear_space(space_id)
+
+        print("Indexing Complete.")
+
+    def _delete_document_chunks(self, db_ids):
+        """
+        A re-upload keeps its document id, so the ids above only overwrite the first N
+        chunks; drop the previous version's rows first, or a shorter new version would
+        leave its old trailing chunks searchable. metadata @> {db_id} uses the GIN index.
+        """
+        for db_id in db_ids:
+            if db_id is not None:
+                self.supabase.table("document_chunks").delete().contains("metadata", {"db_id": db_id}).execute()
+
+    def _store_chunks(self, documents: List[Document], ids: List[str]):
+        """Coalescer flush: embeds every chunk in one request and upserts them."""
+        if documents:
+            self.vectorstore.add_documents(documents, ids=ids)
 
     def query(self, user_query: str, space_id: int = None, history_messages: List[Dict] = None) -> Dict[str, Any]:
         """
@@ -167,76 +465,76 @@ class AdvancedRAGSystem:
         2. BM25: Selects the specific retriever for the given space_id.
         3. Reranks the combined results.
         """
+        early_result, plan = self._prepare_answer(user_query, space_id, history_messages)
+        if early_result is not None:
+            return early_result
+
+        try:
+            response_text = plan["chain"].invoke(plan["inputs"])
+        except Exception as e:
+            return {
+                "answer": "An error occurred while generating the response.",
+                "source_document": plan["source_document"],
+                "error": str(e)
+            }
+        return self._finish_answer(plan, response_text)
+
+    def stream_query(self, user_query: str, space_id: int = None,
+                     history_messages: List[Dict] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Same pipeline as query(), but yields ("token", text) while the LLM decodes
+        and finally ("result", dict) with the same shape query() returns.
+        """
+        early_result, plan = self._prepare_answer(user_query, space_id, history_messages)
+        if early_result is not None:
+            yield "token", early_result["answer"]
+            yield "result", early_result
+            return
+
+        parts = []
+        try:
+            for piece in plan["chain"].stream(plan["inputs"]):
+                parts.append(piece)
+                yield "token", piece
+        except Exception as e:
+            yield "result", {
+                "answer": "An error occurred while generating the response.",
+                "source_document": plan["source_document"],
+                "error": str(e)
+            }
+            return
+        yield "result", self._finish_answer(plan, "".join(parts))
+
+    def _prepare_answer(self, user_query: str, space_id: int, history_messages: List[Dict]):
+        """
+        Everything before generation: contextualize, retrieve, rerank, build the prompt.
+        Returns (result, None) when no LLM call is needed, else (None, plan).
+        """
         print(f"\n--- Querying: {user_query} (Space ID: {space_id}) ---")
 
         # --- STEP 0: Query Contextualization ---
         # We use the rewritten query for SEARCH, but the original query for the final CHAT.
         search_query = user_query
+        query_vector = None
         if history_messages:
             search_query = self.contextualize_query(user_query, history_messages)
+        else:
+            # Without history the answer depends only on (question, space), so a close
+            # enough earlier question can answer this one. The embedding is memoized and
+            # reused by _vector_search below, so a miss costs no extra embedding call.
+            query_vector = np.asarray(self._embed_query_cached(user_query), dtype=np.float32)
+            cached = self.semantic_cache.lookup(space_id, query_vector)
+            if cached is not None:
+                print("DEBUG: Semantic cache hit")
+                return cached, None
     
-        # --- STEP 1: Vector Retrieval (Supabase) ---
-        # We explicitly filter by space_id using metadata
-        vector_docs = []
-        
-        try:
-            # 1. Generate the embedding vector for the query
-            query_vector = self.embeddings.embed_query(search_query)
-            
-            # 2. Prepare params for the SQL function
-            params = {
-                "query_embedding": query_vector,
-                "match_threshold": 0.5, # Adjust this threshold as needed
-                "match_count": TOP_K_RETRIEVAL,
-                "filter": {'space_id': space_id} if space_id else {}
-            }
-            
-            # 3. Execute RPC
-            response = self.supabase.rpc("match_document_chunks", params).execute()
-            
-            # 4. Convert results to LangChain Documents
-            if response.data:
-                for item in response.data:
-                    doc = Document(
-                        page_content=item['content'],
-                        metadata=item['metadata']
-                    )
-                    vector_docs.append(doc)
-            
-            print(f"DEBUG: Vector RPC returned {len(vector_docs)} documents")
-            
-        except Exception as e:
-            print(f"Vector Error: {e}")
-            vector_docs = []
-
-            
-        # --- STEP 2: Keyword Retrieval (Supabase Full Text Search) ---
-        # Replaces BM25. We call the RPC function we created in SQL.
-        print("Running Keyword Search via Supabase RPC...")
-        
-        rpc_params = {
-            "query_text": search_query, 
-            "match_count": TOP_K_RETRIEVAL,
-            "filter_space_id": space_id  # Pass as int or None, not string
-        }
-        try:
-            keyword_response = self.supabase.rpc("kw_match_document_chunks", rpc_params).execute()
-        except Exception as e:
-            print(f"ERROR in RPC call: {type(e).__name__}: {str(e)}")
-            print(f"ERROR details: {repr(e)}")
-            keyword_response = None
-
-        # Convert RPC response back to LangChain Documents
-        keyword_docs = []
-        if keyword_response and keyword_response.data:
-            for item in keyword_response.data:
-                doc = Document(
-                    page_content=item['content'],
-                    metadata=item['metadata']
-                )
-                keyword_docs.append(doc)
-        
-        print(f"DEBUG: Converted {len(keyword_docs)} keyword documents")
+        # --- STEP 1 & 2: Vector + Keyword Retrieval (Supabase, in parallel) ---
+        # Both are network-bound RPCs that release the GIL while waiting,
+        # so running them side by side costs one round-trip instead of two.
+        vector_future = self.retrieval_pool.submit(self._vector_search, search_query, space_id)
+        keyword_future = self.retrieval_pool.submit(self._keyword_search, search_query, space_id)
+        vector_docs = vector_future.result()
+        keyword_docs = keyword_future.result()
 
         # --- STEP 3: Ensemble (Merge & Deduplicate) ---
         # Combine lists and remove duplicates based on page_content
@@ -247,7 +545,7 @@ class AdvancedRAGSystem:
 
         if not combined_docs:
             print("DEBUG: No documents found, returning empty response")
-            return {"answer": "I couldn't find relevant information in this space.", "source_document": None}
+            return {"answer": "I couldn't find relevant information in this space.", "source_document": None}, None
 
         # --- STEP 4: Reranking (Cross Encoder) ---
         # We manually call the compressor on our combined list
@@ -265,7 +563,7 @@ class AdvancedRAGSystem:
 
         if not reranked_docs:
             print("DEBUG: No documents after reranking, returning empty response")
-            return {"answer": "Found documents, but they weren't relevant enough.", "source_document": None}
+            return {"answer": "Found documents, but they weren't relevant enough.", "source_document": None}, None
 
         # --- STEP 5: Prepare Context & LLM (Standard Logic) ---
         
@@ -273,37 +571,10 @@ class AdvancedRAGSystem:
         top_doc = reranked_docs[0]
         top_source_filename = top_doc.metadata.get('source_document', 'Unknown Document')
 
-        def format_docs(docs):
-            formatted_results = []
-            for doc in docs:
-                # Use original content if available (cleaner), otherwise use contextualized
-                content = doc.metadata.get('original_content', doc.page_content)
-                source_file = doc.metadata.get('source_document', 'Unknown')
-                formatted_results.append(f"<source doc='{source_file}'>\n{content}\n</source>")
-            return "\n\n".join(formatted_results)
-
-        context_text = format_docs(reranked_docs)
+        context_text = format_context(reranked_docs)
 
-        system_prompt = (
-            "Your name is Clark, you were created by Omar the G. You are an expert Engineering Professor and Tutor. Your goal is to help college students "
-            "deeply understand complex engineering concepts based on the provided course material.\n\n"
-            
-            "INSTRUCTIONS:\n"
-            "1. **Core Accuracy**: Base your factual answer primarily on the provided CONTEXT below. "
-            "Do not contradict the context.\n"
-            "2. **Elaboration & Depth**: Do not just summarize. Expand on the concepts mentioned in the context whenever you see fit. "
-            "Explain the 'Why' and 'How' behind the theories. If the context is brief, use your internal knowledge "
-            "to provide the theoretical background.\n"
-            "3. **Examples**: Provide concrete, real-world engineering examples or analogies to illustrate the points, whenever you see fits, "
-            "even if they are not explicitly in the context.\n"
-            "4. **Structure**: Use clear formatting, bullet points, and bold text to make the answer easy to read.\n"
-            "5. **Citation**: explicitely mention what part of the answer comes from the context and what part is your own elaboration.\n\n"
-            
-            "CONTEXT:\n"
-            "{context}"
-        )
         # Build Prompt: System -> History -> Original Question
-        messages_list = [("system", system_prompt)]
+        messages_list = [("system", SYSTEM_PROMPT)]
 
         if history_messages:
             for msg in history_messages:
@@ -317,20 +588,18 @@ class AdvancedRAGSystem:
 
         chain = prompt | self.llm | StrOutputParser()
 
+        return None, {
+            "chain": chain,
+            "inputs": {"context": context_text, "question": user_query},
+            "top_doc": top_doc,
+            "source_document": top_source_filename,
+            "space_id": space_id,
+            "query_vector": query_vector,
+        }
 
-        try:
-            response_text = chain.invoke({
-                "context": context_text,
-                "question": user_query
-            })
-
-        except Exception as e:
-
-            return {
-                "answer": "An error occurred while generating the response.",
-                "source_document": top_source_filename,
-                "error": str(e)
-            }
+    def _finish_answer(self, plan: Dict[str, Any], response_text: str) -> Dict[str, Any]:
+        top_doc = plan["top_doc"]
+        top_source_filename = plan["source_document"]
 
         # Debug print
         print({
@@ -339,12 +608,74 @@ class AdvancedRAGSystem:
             "top_chunk_page_content": top_doc.page_content[:200] + "..." 
         })
 
-        return {
+        result = {
             "answer": response_text,
             "source_document": top_source_filename,
             "top_chunk_page_content": top_doc.page_content[:200] + "..." 
         }
+        if plan["query_vector"] is not None:
+            self.semantic_cache.add(plan["space_id"], plan["query_vector"], result)
+        return result
     
+    def _vector_search(self, search_query: str, space_id: int = None) -> List[Document]:
+        """Semantic search via the match_document_chunks RPC, filtered by space."""
+        vector_docs = []
+        try:
+            # 1. Generate the embedding vector for the query
+            query_vector = list(self._embed_query_cached(search_query))
+            
+            # 2. Prepare params for the SQL function
+            params = {
+                "query_embedding": query_vector,
+                "match_threshold": 0.5, # Adjust this threshold as needed
+                "match_count": TOP_K_RETRIEVAL,
+                "filter": {'space_id': space_id} if space_id else {}
+            }
+            
+            # 3. Execute RPC
+            response = self.supabase.rpc("match_document_chunks", params).execute()
+            
+            # 4. Convert results to LangChain Documents
+            if response.data:
+                vector_docs = [
+                    Document(page_content=item['content'], metadata=item['metadata'])
+                    for item in response.data
+                ]
+            
+            print(f"DEBUG: Vector RPC returned {len(vector_docs)} documents")
+            
+        except Exception as e:
+            print(f"Vector Error: {e}")
+            vector_docs = []
+        return vector_docs
+
+    def _keyword_search(self, search_query: str, space_id: int = None) -> List[Document]:
+        """Full text search via the kw_match_document_chunks RPC (replaces BM25)."""
+        print("Running Keyword Search via Supabase RPC...")
+        
+        rpc_params = {
+            "query_text": search_query, 
+            "match_count": TOP_K_RETRIEVAL,
+            "filter_space_id": space_id  # Pass as int or None, not string
+        }
+        try:
+            keyword_response = self.supabase.rpc("kw_match_document_chunks", rpc_params).execute()
+        except Exception as e:
+            print(f"ERROR in RPC call: {type(e).__name__}: {str(e)}")
+            print(f"ERROR details: {repr(e)}")
+            keyword_response = None
+
+        # Convert RPC response back to LangChain Documents
+        keyword_docs = []
+        if keyword_response and keyword_response.data:
+            keyword_docs = [
+                Document(page_content=item['content'], metadata=item['metadata'])
+                for item in keyword_response.data
+            ]
+        
+        print(f"DEBUG: Converted {len(keyword_docs)} keyword documents")
+        return keyword_docs
+
     def contextualize_query(self, user_query: str, history_messages: List[Dict]) -> str:
         """
         If history exists, rewrite the query to be standalone.
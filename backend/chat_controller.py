@@ -1,10 +1,26 @@
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterator, Tuple
 from handlers import OmarHandlers
 
 # from advanced_rag import AdvancedRAGSystem # The Intelligence (Imported in main, passed in init)
 
 logger = logging.getLogger("ChatController")
 
+# Exact-match cache of RAG answers. The key is (normalized query, space, parent message,
+# use_history): messages are append-only, so a parent id pins the whole history the
+# answer was generated from. Document uploads clear their space's entries in this
+# process; the TTL bounds how long other workers keep serving pre-upload answers.
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))  # seconds
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
 
 class ChatController:
     def __init__(self, db_manager, rag_system):
@@ -15,65 +31,148 @@ class ChatController:
         self.state_handler = OmarHandlers(db_manager)
         self.rag = rag_system
 
+        # LRU of cache key -> (expires_at, rag_result dict)
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+
+    def _cached_response(self, key):
+        with self._response_cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if time.monotonic() >= expires_at:
+                del self._response_cache[key]
+                return None
+            self._response_cache.move_to_end(key)
+            return result
+
+    def _remember_response(self, key, rag_result: dict):
+        # Errors and empty answers are retried next time rather than replayed
+        if rag_result.get('error') or not rag_result.get('source_document'):
+            return
+        with self._response_cache_lock:
+            self._response_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, rag_result)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
+    def invalidate_space(self, space_id: int):
+        """Drops cached answers for a space whose documents changed."""
+        with self._response_cache_lock:
+            for key in [k for k in self._response_cache if k[1] == space_id]:
+                del self._response_cache[key]
+
     def process_user_query(self, user_id: int, query_text: str, space_id: int, thread_id: int = None,
                            parent_message_id: int = None, use_history: bool = True, is_fork: bool = False,
                            branch_id: int = None) -> dict:
         """
         Main Business Logic Flow:
         1. Prepare DB State (Thread/Parent/Fork detection)
-        2. Log User Message
-        3. Fetch History (Memory)
-        4. Call AI (RAG)
-        5. Log AI Response
-        6. Update Document Anchors
+        2. Fetch History (Memory)
+        3. Call AI (RAG)
+        4. Log (new Thread +) User Message + AI Response (single transaction)
+        5. Update Document Anchors
         
         Args:
             branch_id: If continuing a branch, pass the branch_id to get correct parent context
         """
+        for kind, value in self._run_turn(user_id, query_text, space_id, thread_id, parent_message_id,
+                                          use_history, is_fork, branch_id, stream=False):
+            if kind == "done":
+                return value
 
+    def stream_user_query(self, user_id: int, query_text: str, space_id: int, thread_id: int = None,
+                          parent_message_id: int = None, use_history: bool = True, is_fork: bool = False,
+                          branch_id: int = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Same flow as process_user_query, but yields ("token", text) while the answer is
+        generated and then ("done", response) with the process_user_query response dict.
+        The messages are logged once the full answer exists, before "done".
+        """
+        return self._run_turn(user_id, query_text, space_id, thread_id, parent_message_id,
+                              use_history, is_fork, branch_id, stream=True)
+
+    def _run_turn(self, user_id, query_text, space_id, thread_id, parent_message_id,
+                  use_history, is_fork, branch_id, stream: bool):
+        """Shared body of both entry points; only emits "token" events when stream=True."""
         # 1. State Preparation
-        current_thread_id = self.state_handler.ensure_thread(user_id, query_text,space_id, thread_id)
-        actual_parent_id = self.state_handler.resolve_parent_message(current_thread_id, parent_message_id, branch_id)
-
-        # 2. Log User Message
-        user_msg_id = self.state_handler.log_user_message(
-            thread_id=current_thread_id,
-            user_id=user_id,
-            content=query_text,
-            parent_id=actual_parent_id,
-            is_fork=is_fork
-        )
-
-        # 3. Memory Retrieval
-        history_context = []
-        if use_history and actual_parent_id:
-            history_context = self.state_handler.get_chat_history(actual_parent_id)
+        if thread_id is None:
+            # Brand-new thread: it has no messages, so there is no parent to look up and
+            # no history; the thread row is written together with the first exchange.
+            actual_parent_id = parent_message_id
         else:
-            logger.info("Starting fresh context (History disabled or new thread).")
+            actual_parent_id = self.state_handler.resolve_parent_message(thread_id, parent_message_id, branch_id)
 
-        # 4. Intelligence (RAG Query)
-        # We pass the history we just fetched to the AI
-        rag_result = self.rag.query(query_text, space_id=space_id,history_messages= history_context)
+        def persist(ai_text, anchor_document_id=None):
+            return self.state_handler.log_exchange(
+                thread_id=thread_id,
+                user_id=user_id,
+                query_text=query_text,
+                ai_text=ai_text,
+                parent_id=actual_parent_id,
+                is_fork=is_fork,
+                anchor_document_id=anchor_document_id,
+                space_id=space_id
+            )
+
+        cache_key = (_normalize_query(query_text), space_id, actual_parent_id, use_history)
+        rag_result = self._cached_response(cache_key)
+        if rag_result is not None:
+            logger.info("Serving cached answer (skipping history, retrieval and LLM).")
+            if stream:
+                try:
+                    yield "token", rag_result.get('answer', "")
+                except GeneratorExit:
+                    # Client went away before "done": the answer is complete, keep it.
+                    persist(rag_result.get('answer', ""))
+                    raise
+        else:
+            # 2. Memory Retrieval
+            history_context = []
+            if use_history and actual_parent_id:
+                history_context = self.state_handler.get_chat_history(actual_parent_id)
+            else:
+                logger.info("Starting fresh context (History disabled or new thread).")
+
+            # 3. Intelligence (RAG Query)
+            # We pass the history we just fetched to the AI
+            if stream:
+                tokens = []
+                rag_stream = self.rag.stream_query(query_text, space_id=space_id, history_messages=history_context)
+                try:
+                    for kind, value in rag_stream:
+                        if kind == "token":
+                            tokens.append(value)
+                            yield "token", value
+                        else:
+                            rag_result = value
+                except GeneratorExit:
+                    # Client disconnected mid-answer: stop generating, but still log the
+                    # exchange with what was produced so the turn isn't lost from the thread.
+                    rag_stream.close()
+                    persist(rag_result.get('answer', "") if rag_result else "".join(tokens))
+                    raise
+            else:
+                rag_result = self.rag.query(query_text, space_id=space_id,history_messages= history_context)
+            self._remember_response(cache_key, rag_result)
 
         ai_text = rag_result.get('answer', "Error processing response.")
         source_doc = rag_result.get('source_document')
 
-        # 5. Log AI Response
-        self.state_handler.log_ai_response(
-            thread_id=current_thread_id,
-            content=ai_text,
-            parent_id=user_msg_id  # AI replies to the user's new message
-        )
-
-        # 6. Post-Processing (Anchoring)
-        # Only anchor if this is a new thread (thread_id was None initially)
+        # 4. Anchoring: only a new thread (thread_id was None initially) is linked to
+        # the document RAG used. The id lookup is cached; the link is written below.
+        anchor_doc_id = None
         if source_doc and thread_id is None:
-            self.state_handler.anchor_thread_to_document(current_thread_id, source_doc, space_id)
+            anchor_doc_id = self.state_handler.resolve_anchor_document(source_doc, space_id)
+
+        # 5. Log (new thread +) User Message + AI Response (+ anchor)
+        # Everything is written together once the answer exists: one round-trip, one commit.
+        current_thread_id, user_msg_id, _ = persist(ai_text, anchor_doc_id)
 
-        # 7. Return API Response
+        # 6. Return API Response
         # For forks, the branch_id is the user message ID (fork start point)
         response_branch_id = user_msg_id if is_fork else None
-        return {
+        yield "done", {
             "thread_id": current_thread_id,
             "response": ai_text,
             "source": source_doc,
@@ -4,9 +4,17 @@ from db import engine, Base
 async def init_models():
     print("Creating Auth tables (Users)...")
     async with engine.begin() as conn:
-        # This looks at your 'User' class in db.py and generates the correct SQL
-        await conn.run_sync(Base.metadata.create_all)
+        # This looks at your 'User' class in db.py and generates the correct SQL.
+        # checkfirst skips the CREATE round-trip for tables that already exist.
+        await conn.run_sync(Base.metadata.create_all, checkfirst=True)
     print("✅ Users table created successfully.")
 
+async def main():
+    # Reuse the app's module-level engine, and close it cleanly when run as a script
+    try:
+        await init_models()
+    finally:
+        await engine.dispose()
+
 if __name__ == "__main__":
-    asyncio.run(init_models())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,8 +1,14 @@
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.extras import RealDictCursor, execute_values
+import itertools
 import logging
-from typing import List, Dict, Optional
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import List, Dict, Optional, Tuple
 import os
 from dotenv import load_dotenv
 
@@ -18,38 +24,215 @@ DB_CONFIG = {
     'database': os.getenv('POSTGRES_DATABASE', 'postgres')
 }
 
+# Same server-side timeouts as the auth engine (db.py), sent as startup options.
+# Off by default: Supabase's transaction pooler (the default port 6543) can't carry
+# startup options, so set these only against the session endpoint (5432) or a
+# direct connection, or put them on the role (ALTER ROLE ... SET statement_timeout).
+_SERVER_TIMEOUTS = {
+    "statement_timeout": os.getenv('DB_STATEMENT_TIMEOUT_MS', ''),
+    "idle_in_transaction_session_timeout": os.getenv('DB_IDLE_TX_TIMEOUT_MS', ''),
+}
+if any(_SERVER_TIMEOUTS.values()):
+    DB_CONFIG['options'] = " ".join(f"-c {name}={value}" for name, value in _SERVER_TIMEOUTS.items() if value)
+
+# Seconds to wait for a new connection's TCP/TLS handshake; without it a degraded
+# database stalls each checkout on SYN retransmits instead of failing fast
+DB_CONFIG['connect_timeout'] = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+
+POOL_MIN_CONN = int(os.getenv('DB_POOL_MIN', 4))
+POOL_MAX_CONN = int(os.getenv('DB_POOL_MAX', 20))
+# Seconds a caller waits for a free pooled connection before giving up
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Circuit breaker: after this many consecutive failed connection attempts, checkouts
+# fail immediately for BREAKER_COOLDOWN seconds instead of each waiting out a timeout
+BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.getenv('DB_BREAKER_COOLDOWN', 10))
+
+# Messages are append-only, so the ancestor chain of a message never changes.
+# That makes get_context_messages safe to memoize per parent_message_id.
+CONTEXT_CACHE_SIZE = 4096
+CONTEXT_HISTORY_LIMIT = 6
+
+# (space_id, filename) -> document id. Filenames per space are near-static and only
+# add_document can change the answer, so it invalidates its own key.
+DOC_ID_CACHE_SIZE = 4096
+
+# space_id -> document list for the sidebar. Writes through this DBManager invalidate
+# it immediately; the TTL bounds staleness from writes made by other processes.
+DOC_LIST_CACHE_SIZE = 64
+DOC_LIST_CACHE_TTL = 30  # seconds
+
+# Sentinel understood by the messages BEFORE INSERT trigger: "this row starts a new branch"
+FORK_START_BRANCH_ID = -1
+
+# Row shapes for the list endpoints. These use the plain tuple cursor: building a
+# RealDictRow costs a Python-level __setitem__ per column, a namedtuple doesn't.
+ThreadRow = namedtuple("ThreadRow", "id title creator_user_id created_at")
+DocumentRow = namedtuple("DocumentRow", "id filename file_type file_url status uploaded_at")
+BranchMessageRow = namedtuple("BranchMessageRow", "id thread_id user_id role content created_at branch_id forks")
+
+# Per-message fork previews, aggregated in SQL (idx_messages_fork_starts) so the
+# endpoints don't fetch forks separately and stitch them onto messages in Python.
+# Expects the outer message row to be aliased "m".
+FORKS_LATERAL = """
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(json_agg(json_build_object(
+                   'branch_id', b.id,
+                   'preview', left(b.content, 150),
+                   'created_at', b.created_at
+               ) ORDER BY b.id), '[]'::json) AS forks
+        FROM messages b
+        WHERE b.thread_id = m.thread_id AND b.parent_message_id = m.id AND b.branch_id = b.id
+    ) f ON TRUE
+"""
+
+# Thread info + its MAIN THREAD messages (branch_id IS NULL), each carrying its
+# fork previews, in one round-trip. The LATERAL subquery aggregates the messages
+# into a JSON array.
+THREAD_WITH_MESSAGES_QUERY = """
+    SELECT t.id, t.title, t.creator_user_id, t.is_public, t.created_at,
+           ca.page_number, msgs.messages
+    FROM threads t
+    LEFT JOIN context_anchors ca ON t.id = ca.thread_id
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(json_agg(m ORDER BY m.id), '[]'::json) AS messages
+        FROM (
+            SELECT m.id, m.user_id, m.role, m.content, m.path, m.parent_message_id,
+                   m.branch_id, m.created_at, f.forks
+            FROM messages m
+            """ + FORKS_LATERAL + """
+            WHERE m.thread_id = t.id AND m.branch_id IS NULL
+        ) m
+    ) msgs ON TRUE
+    WHERE t.id = %s
+    LIMIT 1
+"""
+
+# Server-side PREPARE for the hot single-row reads. Prepared statements live in the
+# backend session, so this only works on a direct/session-mode connection (5432);
+# Supabase's transaction pooler on 6543 hands each transaction a different backend.
+USE_SERVER_PREPARE = os.getenv('DB_SERVER_PREPARE', 'false').lower() == 'true'
+
+HOT_QUERIES = {
+    "last_msg_main": "SELECT id FROM messages WHERE thread_id = %s AND branch_id IS NULL ORDER BY id DESC LIMIT 1",
+    "last_msg_branch": "SELECT id FROM messages WHERE thread_id = %s AND branch_id = %s ORDER BY id DESC LIMIT 1",
+    "msg_by_id": "SELECT * FROM messages WHERE id = %s",
+    # Exact match (not LIKE '%name') so the (space_id, filename) index is usable.
+    "doc_by_filename": "SELECT id FROM documents WHERE space_id = %s AND filename = %s LIMIT 1",
+    # Single round-trip: the parent's stored ancestor_ids (root ... parent) drive
+    # an index lookup of the newest ancestors; no path parsing anywhere.
+    "ctx_history": """
+        SELECT role, content
+        FROM messages
+        WHERE id = ANY((SELECT ancestor_ids FROM messages WHERE id = %s))
+        ORDER BY id DESC
+        LIMIT %s
+    """,
+}
+
 logger = logging.getLogger("DB_Manager")
 
 
+class PreparingConnection(PGConnection):
+    """psycopg2 connection that remembers which HOT_QUERIES it has PREPAREd."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def _execute_hot(cursor, name: str, params: tuple):
+    """
+    Runs one of HOT_QUERIES. With DB_SERVER_PREPARE on, the statement is parsed and
+    planned once per pooled connection and then reused through EXECUTE.
+    """
+    query = HOT_QUERIES[name]
+    if not USE_SERVER_PREPARE:
+        cursor.execute(query, params)
+        return
+
+    conn = cursor.connection
+    if name not in conn.prepared:
+        counter = itertools.count(1)
+        server_query = re.sub(r"%s", lambda _: f"${next(counter)}", query)
+        cursor.execute(f"PREPARE {name} AS {server_query}")
+        conn.prepared.add(name)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {name}({placeholders})", params)
+
+
 class DBManager:
     def __init__(self):
-        self.pool = psycopg2.pool.SimpleConnectionPool(1, 20, **DB_CONFIG)
+        # ThreadedConnectionPool guards getconn/putconn with a lock, so the pool is
+        # safe to share between the event loop and worker threads.
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            POOL_MIN_CONN, POOL_MAX_CONN, connection_factory=PreparingConnection, **DB_CONFIG
+        )
+        # getconn() raises PoolError as soon as all POOL_MAX_CONN connections are out,
+        # and the worker threadpools are larger than that. Callers queue here instead.
+        self._pool_slots = threading.BoundedSemaphore(POOL_MAX_CONN)
+
+        # Consecutive connect failures and the monotonic time the breaker stays open until
+        self._connect_failures = 0
+        self._breaker_open_until = 0.0
+        self._breaker_lock = threading.Lock()
+
+        # LRU of parent_message_id -> tuple of history rows
+        self._context_cache = OrderedDict()
+        self._context_cache_lock = threading.Lock()
+
+        # LRU of (space_id, filename) -> document id (hits only; misses always go to the DB)
+        self._doc_id_cache = OrderedDict()
+        self._doc_id_cache_lock = threading.Lock()
+
+        # LRU of space_id -> (expires_at, tuple of document dicts)
+        self._doc_list_cache = OrderedDict()
+        self._doc_list_cache_lock = threading.Lock()
 
     def get_connection(self):
-        return self.pool.getconn()
-
-    # --- THREADS ---
-    def create_thread(self, space_id: int, title: str, creator_id: int) -> int:
         """
-        Starts a new conversation thread inside a specific Space.
+        Borrows a pooled connection, waiting up to POOL_TIMEOUT for one to free up.
+        Raises PoolError at once while the circuit breaker is open.
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        if time.monotonic() < self._breaker_open_until:
+            raise pool.PoolError("database unavailable: circuit open after repeated connection failures")
+        if not self._pool_slots.acquire(timeout=POOL_TIMEOUT):
+            raise pool.PoolError(f"no database connection free after {POOL_TIMEOUT}s")
+        try:
+            conn = self.pool.getconn()
+        except psycopg2.OperationalError:
+            # The pool had to open a new connection and the server didn't answer
+            self._pool_slots.release()
+            self._record_connect_failure()
+            raise
+        except Exception:
+            self._pool_slots.release()
+            raise
+        if self._connect_failures:
+            with self._breaker_lock:
+                self._connect_failures = 0
+        return conn
+
+    def _record_connect_failure(self):
+        with self._breaker_lock:
+            self._connect_failures += 1
+            if self._connect_failures >= BREAKER_FAILURES:
+                self._breaker_open_until = time.monotonic() + BREAKER_COOLDOWN
+                self._connect_failures = 0
+                logger.error(f"Database unreachable; failing fast for {BREAKER_COOLDOWN}s")
+
+    def release_connection(self, conn):
+        """Returns a connection from get_connection to the pool."""
         try:
-            # PostgreSQL uses RETURNING to get the new ID
-            query = "INSERT INTO threads (space_id, title, creator_user_id) VALUES (%s, %s, %s) RETURNING id"
-            cursor.execute(query, (space_id, title, creator_id))
-            thread_id = cursor.fetchone()[0]
-            conn.commit()
-            return thread_id
-        finally:
-            cursor.close()
             self.pool.putconn(conn)
+        finally:
+            self._pool_slots.release()
 
+    # --- THREADS ---
     def get_threads_for_space(self, space_id: int) -> List[Dict]:
         """(New) Gets all conversations in a specific workspace."""
         conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor()
         try:
             query = """
                 SELECT id, title, creator_user_id, created_at
@@ -58,10 +241,10 @@ class DBManager:
                 ORDER BY created_at DESC
             """
             cursor.execute(query, (space_id,))
-            return cursor.fetchall()
+            return [ThreadRow._make(row)._asdict() for row in cursor.fetchall()]
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     def get_last_message_id(self, thread_id: int, branch_id: int = None) -> Optional[int]:
         """
@@ -74,233 +257,375 @@ class DBManager:
         try:
             if branch_id is not None:
                 # Get last message in specific branch
-                query = "SELECT id FROM messages WHERE thread_id = %s AND branch_id = %s ORDER BY id DESC LIMIT 1"
-                cursor.execute(query, (thread_id, branch_id))
+                _execute_hot(cursor, "last_msg_branch", (thread_id, branch_id))
             else:
                 # Get last message in main thread only
-                query = "SELECT id FROM messages WHERE thread_id = %s AND branch_id IS NULL ORDER BY id DESC LIMIT 1"
-                cursor.execute(query, (thread_id,))
+                _execute_hot(cursor, "last_msg_main", (thread_id,))
             result = cursor.fetchone()
             return result[0] if result else None
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     # --- MESSAGES & FORKING LOGIC ---
-    def add_message(self, thread_id: int, user_id: int, role: str, content: str,
-                    parent_message_id: int = None, is_fork_start: bool = False) -> int:
+    def append_message(self, thread_id: int, user_id: int, content: str) -> int:
         """
-        Adds a message and handles Path + Branch logic.
-        :param is_fork_start: If True, this message starts a new Branch (Branch ID = New Message ID).
+        Adds a user message after the last main-thread message in ONE statement:
+        the parent is looked up inside the INSERT instead of by a separate
+        get_last_message_id round-trip. Returns the new message id.
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
-            # 1. Determine Parent Info (Path and Branch ID)
-            parent_path = ""
-            inherited_branch_id = None  # Default for Main Thread (NULL)
-
-            if parent_message_id:
-                cursor.execute("SELECT path, branch_id FROM messages WHERE id = %s", (parent_message_id,))
-                result = cursor.fetchone()
-                if result:
-                    parent_path = result[0]
-                    inherited_branch_id = result[1]
-
-            # 2. Insert the message (with temp path)
-            # We insert 'branch_id' as NULL initially if it's a new fork, we'll update it momentarily.
             insert_query = """
-                INSERT INTO messages (thread_id, user_id, role, content, path, parent_message_id, branch_id) 
-                VALUES (%s, %s, %s, %s, '', %s, %s)
+                SET LOCAL synchronous_commit TO OFF;
+                INSERT INTO messages (thread_id, user_id, role, content, parent_message_id)
+                SELECT %(thread_id)s, %(user_id)s, 'user', %(content)s,
+                       (SELECT id FROM messages
+                        WHERE thread_id = %(thread_id)s AND branch_id IS NULL
+                        ORDER BY id DESC LIMIT 1)
+                RETURNING id
             """
-            # If it's a normal reply, we inherit. If it's a fork start, we set NULL (to fill later)
-            initial_branch_val = None if is_fork_start else inherited_branch_id
+            with conn:
+                cursor.execute(insert_query, {
+                    "thread_id": thread_id,
+                    "user_id": user_id,
+                    "content": content,
+                })
+                new_msg_id = cursor.fetchone()[0]
+
+            return new_msg_id
+        finally:
+            cursor.close()
+            self.release_connection(conn)
 
-            # PostgreSQL: Add RETURNING to get the new ID
+    def add_exchange(self, thread_id: Optional[int], user_id: int, user_content: str, ai_content: str,
+                     parent_message_id: int = None, is_fork_start: bool = False,
+                     anchor_document_id: int = None, space_id: int = None,
+                     thread_title: str = None) -> Tuple[int, int, int]:
+        """
+        Stores a user message and the assistant reply to it in one transaction and one
+        round-trip. The reply's parent is currval() of the id sequence, i.e. the row
+        the first INSERT just created (currval is session-local, so this is race-free).
+        With thread_id=None the thread itself (space_id, thread_title) is created first
+        in the same script, so a conversation's first turn costs one round-trip too.
+        With anchor_document_id, the thread's context anchor (page 1) is written in the
+        same round-trip as well.
+        Returns (thread_id, user_message_id, assistant_message_id).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            if thread_id is None:
+                thread_query = """
+                INSERT INTO threads (space_id, title, creator_user_id)
+                VALUES (%(space_id)s, %(thread_title)s, %(user_id)s);
+                """
+                thread_ref = "currval(pg_get_serial_sequence('threads', 'id'))"
+            else:
+                thread_query = ""
+                thread_ref = "%(thread_id)s"
+            anchor_query = """
+                INSERT INTO context_anchors (thread_id, document_id, page_number)
+                SELECT """ + thread_ref + """, id, 1 FROM documents WHERE id = %(anchor_document_id)s
+                ON CONFLICT (thread_id, document_id, page_number) DO NOTHING;
+            """ if anchor_document_id else ""
+            # (SELECT ... FROM documents: a document deleted meanwhile just means no anchor,
+            # instead of a foreign-key error that would roll back the messages too)
+            # The RETURNING insert stays last: fetchone() reads the final statement
             insert_query = """
-                INSERT INTO messages (thread_id, user_id, role, content, path, parent_message_id, branch_id) 
-                VALUES (%s, %s, %s, %s, '', %s, %s) RETURNING id
+                SET LOCAL synchronous_commit TO OFF;
+            """ + thread_query + anchor_query + """
+                INSERT INTO messages (thread_id, user_id, role, content, parent_message_id, branch_id)
+                VALUES (""" + thread_ref + """, %(user_id)s, 'user', %(user_content)s, %(parent_id)s, %(branch_id)s);
+                INSERT INTO messages (thread_id, user_id, role, content, parent_message_id)
+                VALUES (""" + thread_ref + """, 0, 'assistant', %(ai_content)s,
+                        currval(pg_get_serial_sequence('messages', 'id')))
+                RETURNING thread_id, parent_message_id, id
             """
-            cursor.execute(insert_query, (thread_id, user_id, role, content, parent_message_id, initial_branch_val))
-            new_msg_id = cursor.fetchone()[0]
-
-            # 3. Calculate Final Path & Branch ID
-            new_path = f"{parent_path}{new_msg_id}/" if parent_message_id else f"{new_msg_id}/"
-
-            # Logic: If this is a fork start, the Branch ID is the Message's OWN ID.
-            final_branch_id = new_msg_id if is_fork_start else initial_branch_val
-
-            # 4. Update the record
-            update_query = "UPDATE messages SET path = %s, branch_id = %s WHERE id = %s"
-            cursor.execute(update_query, (new_path, final_branch_id, new_msg_id))
-            conn.commit()
+            with conn:
+                cursor.execute(insert_query, {
+                    "thread_id": thread_id,
+                    "space_id": space_id,
+                    "thread_title": thread_title,
+                    "user_id": user_id,
+                    "user_content": user_content,
+                    "ai_content": ai_content,
+                    "parent_id": parent_message_id,
+                    "branch_id": FORK_START_BRANCH_ID if is_fork_start else None,
+                    "anchor_document_id": anchor_document_id,
+                })
+                thread_id, user_msg_id, ai_msg_id = cursor.fetchone()
 
-            return new_msg_id
+            self._prime_context_cache(parent_message_id, (
+                {"role": "user", "content": user_content},
+                {"role": "assistant", "content": ai_content},
+            ), ai_msg_id)
+            return thread_id, user_msg_id, ai_msg_id
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     # --- CONTEXT RETRIEVAL (MEMORY) ---
     def get_context_messages(self, parent_message_id: int) -> List[Dict]:
         """
         Retrieves the conversation history for the AI.
         Uses the Materialized Path to instantly fetch ancestors.
+        Results are cached per parent (ancestors are immutable); callers get fresh dicts.
         """
         if not parent_message_id:
             return []
 
-        conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)  # Return dicts for easy parsing
-        try:
-            # 1. Get the path of the parent message
-            cursor.execute("SELECT path FROM messages WHERE id = %s", (parent_message_id,))
-            result = cursor.fetchone()
-
-            if not result:
-                return []
+        with self._context_cache_lock:
+            cached = self._context_cache.get(parent_message_id)
+            if cached is not None:
+                self._context_cache.move_to_end(parent_message_id)
 
-            path_string = result['path']  # e.g., "1/5/20/"
+        if cached is None:
+            cached = tuple(self._fetch_context_messages(parent_message_id))
+            # Don't remember misses: the id may simply not exist yet
+            if cached:
+                with self._context_cache_lock:
+                    self._context_cache[parent_message_id] = cached
+                    if len(self._context_cache) > CONTEXT_CACHE_SIZE:
+                        self._context_cache.popitem(last=False)
 
-            # 2. Convert path to list of IDs
-            # Remove trailing slash and split
-            ancestor_ids = [int(x) for x in path_string.strip('/').split('/') if x.isdigit()]
+        return [dict(row) for row in cached]
 
-            if not ancestor_ids:
-                return []
+    def _prime_context_cache(self, parent_message_id: Optional[int], new_rows: Tuple[Dict, ...], last_id: int):
+        """
+        The next turn in a thread asks for the history of the reply just written.
+        That is the parent's history plus the new rows, so when the parent's entry is
+        cached (it was just read for this turn) store it without a query.
+        """
+        with self._context_cache_lock:
+            if parent_message_id:
+                parent_rows = self._context_cache.get(parent_message_id)
+                if parent_rows is None:
+                    return
+            else:
+                parent_rows = ()
+            self._context_cache[last_id] = (parent_rows + new_rows)[-CONTEXT_HISTORY_LIMIT:]
+            if len(self._context_cache) > CONTEXT_CACHE_SIZE:
+                self._context_cache.popitem(last=False)
 
-            # 3. Fetch all messages in that chain
-            # Dynamically create placeholder string: %s, %s, %s...
-            format_strings = ','.join(['%s'] * len(ancestor_ids))
-            query = f"""
-                SELECT role, content 
-                FROM messages 
-                WHERE id IN ({format_strings}) 
-                ORDER BY id ASC
-            """
-            cursor.execute(query, tuple(ancestor_ids))
-            all_messages = cursor.fetchall()
-            
-            # Return only the last 6 messages
-            return all_messages[-6:] if len(all_messages) > 6 else all_messages
+    def _fetch_context_messages(self, parent_message_id: int) -> List[Dict]:
+        """Uncached ancestor lookup behind get_context_messages."""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            _execute_hot(cursor, "ctx_history", (parent_message_id, CONTEXT_HISTORY_LIMIT))
+            # Newest-first from the LIMIT; flip back to chronological order. Plain tuples
+            # from the cursor, one small dict each here (no per-row column-name mapping).
+            return [{"role": role, "content": content} for role, content in reversed(cursor.fetchall())]
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     def get_documents_for_space(self, space_id: int) -> List[Dict]:
         """
         (Edited from get_all_documents)
         Now returns documents only for a specific Space.
+        Served from a short-lived per-space cache; callers get fresh dicts.
         """
+        with self._doc_list_cache_lock:
+            cached = self._doc_list_cache.get(space_id)
+            if cached is not None and cached[0] > time.monotonic():
+                self._doc_list_cache.move_to_end(space_id)
+                return [dict(doc) for doc in cached[1]]
+
         conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor()
         try:
             query = """
-                SELECT id, filename, file_type, file_url, uploaded_at
+                SELECT id, filename, file_type, file_url, status, uploaded_at
                 FROM documents
                 WHERE space_id = %s
                 ORDER BY uploaded_at DESC
             """
             cursor.execute(query, (space_id,))
-            return cursor.fetchall()
+            docs = tuple(DocumentRow._make(row)._asdict() for row in cursor.fetchall())
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
+
+        with self._doc_list_cache_lock:
+            self._doc_list_cache[space_id] = (time.monotonic() + DOC_LIST_CACHE_TTL, docs)
+            self._doc_list_cache.move_to_end(space_id)
+            if len(self._doc_list_cache) > DOC_LIST_CACHE_SIZE:
+                self._doc_list_cache.popitem(last=False)
+        return [dict(doc) for doc in docs]
+
+    def _invalidate_doc_list(self, space_id: int):
+        with self._doc_list_cache_lock:
+            self._doc_list_cache.pop(space_id, None)
+
+    def get_document_by_id(self, doc_id: int, space_id: int) -> Optional[Dict]:
+        """
+        One document of a space by primary key (what the PDF viewer opens),
+        instead of listing the whole space and scanning it.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT filename, file_url FROM documents WHERE id = %s AND space_id = %s",
+                (doc_id, space_id)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return {"id": doc_id, "filename": row[0], "file_url": row[1]}
+        finally:
+            cursor.close()
+            self.release_connection(conn)
 
     def get_document_id_by_filename(self, space_id: int, filename: str) -> Optional[int]:
         """
         (Edited) Finds a document ID.
         Now scoped to 'space_id' so you can have 'Invoice.pdf' in two different spaces.
+        Served from an in-process LRU once a filename has been resolved.
         """
+        key = (space_id, filename)
+        with self._doc_id_cache_lock:
+            doc_id = self._doc_id_cache.get(key)
+            if doc_id is not None:
+                self._doc_id_cache.move_to_end(key)
+                return doc_id
+
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
-            query = "SELECT id FROM documents WHERE space_id = %s AND filename LIKE %s LIMIT 1"
-            cursor.execute(query, (space_id, f"%{filename}"))
+            # Callers pass the decoded upload filename, which is what add_document stored.
+            _execute_hot(cursor, "doc_by_filename", (space_id, filename))
             result = cursor.fetchone()
-            return result[0] if result else None
         finally:
             cursor.close()
-            self.pool.putconn(conn)
-
-    def add_document(self, space_id: int, filename: str, file_type: str, file_url: str) -> int:
+            self.release_connection(conn)
+
+        if not result:
+            return None
+        with self._doc_id_cache_lock:
+            self._doc_id_cache[key] = result[0]
+            if len(self._doc_id_cache) > DOC_ID_CACHE_SIZE:
+                self._doc_id_cache.popitem(last=False)
+        return result[0]
+
+    def _invalidate_doc_id(self, space_id: int, filename: str):
+        with self._doc_id_cache_lock:
+            self._doc_id_cache.pop((space_id, filename), None)
+
+    def add_document(self, space_id: int, filename: str, file_type: str, file_url: str,
+                     status: str = 'ready') -> int:
         """
         (New) Registers a document after uploading to Cloud Storage (Koofr/R2).
         Stores the 'file_url' (path) instead of the actual file bytes.
+        Pass status='indexing' when the RAG index is built afterwards.
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
+            # One statement, race-free: a re-upload of the same filename in the same
+            # space refreshes the existing row instead of adding a duplicate. The id is
+            # kept, so indexing clears that document's old chunks before storing the new ones.
             query = """
-                INSERT INTO documents (space_id, filename, file_type, file_url) 
-                VALUES (%s, %s, %s, %s) RETURNING id
+                INSERT INTO documents (space_id, filename, file_type, file_url, status) 
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (space_id, filename) DO UPDATE
+                SET file_type = EXCLUDED.file_type, file_url = EXCLUDED.file_url,
+                    status = EXCLUDED.status, uploaded_at = CURRENT_TIMESTAMP
+                RETURNING id
             """
-            cursor.execute(query, (space_id, filename, file_type, file_url))
+            cursor.execute(query, (space_id, filename, file_type, file_url, status))
             doc_id = cursor.fetchone()[0]
             conn.commit()
+            self._invalidate_doc_id(space_id, filename)
+            self._invalidate_doc_list(space_id)
             return doc_id
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
+    def add_documents(self, space_id: int, documents: List[Tuple[str, str, str]],
+                      status: str = 'ready') -> Dict[str, int]:
+        """
+        add_document for several files at once: (filename, file_type, file_url) rows
+        registered in one statement, one round-trip and one commit.
+        Returns {filename: document id}.
+        """
+        # One row per filename (the last upload wins, as with sequential add_document
+        # calls): ON CONFLICT DO UPDATE can't touch the same row twice in a statement
+        rows = {filename: (space_id, filename, file_type, file_url, status)
+                for filename, file_type, file_url in documents}
+        if not rows:
+            return {}
 
-    def link_thread_to_doc(self, thread_id, doc_id, page_num=1):
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
-            # PostgreSQL uses ON CONFLICT DO NOTHING instead of INSERT IGNORE
             query = """
-                INSERT INTO context_anchors (thread_id, document_id, page_number)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (thread_id, document_id, page_number) DO NOTHING
+                INSERT INTO documents (space_id, filename, file_type, file_url, status)
+                VALUES %s
+                ON CONFLICT (space_id, filename) DO UPDATE
+                SET file_type = EXCLUDED.file_type, file_url = EXCLUDED.file_url,
+                    status = EXCLUDED.status, uploaded_at = CURRENT_TIMESTAMP
+                RETURNING filename, id
             """
-            cursor.execute(query, (thread_id, doc_id, page_num))
+            doc_ids = dict(execute_values(cursor, query, list(rows.values()), page_size=len(rows), fetch=True))
             conn.commit()
+            for filename in rows:
+                self._invalidate_doc_id(space_id, filename)
+            self._invalidate_doc_list(space_id)
+            return doc_ids
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
-    def get_thread_with_messages(self, thread_id: int) -> Optional[Dict]:
-        """
-        Retrieves a thread and only its MAIN thread messages (branch_id IS NULL).
-        Branch messages are excluded to keep the main conversation clean.
-        Returns a dictionary with thread info and list of messages.
-        """
+    def set_document_status(self, doc_id: int, status: str):
         conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor()
         try:
-            # Get thread info
-            thread_query = """
-                SELECT t.id, t.title, t.creator_user_id, t.is_public, t.created_at,
-                       ca.page_number
-                FROM threads t
-                LEFT JOIN context_anchors ca ON t.id = ca.thread_id
-                WHERE t.id = %s
-                LIMIT 1
-            """
-            cursor.execute(thread_query, (thread_id,))
-            thread = cursor.fetchone()
+            cursor.execute("UPDATE documents SET status = %s WHERE id = %s RETURNING space_id", (status, doc_id))
+            row = cursor.fetchone()
+            conn.commit()
+            if row:
+                self._invalidate_doc_list(row[0])
+        finally:
+            cursor.close()
+            self.release_connection(conn)
 
-            if not thread:
-                return None
+    def get_document_status(self, doc_id: int) -> Optional[str]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT status FROM documents WHERE id = %s", (doc_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+        finally:
+            cursor.close()
+            self.release_connection(conn)
 
-            # Get only MAIN THREAD messages (branch_id IS NULL)
-            # This excludes all forked/branched messages
-            messages_query = """
-                SELECT id, user_id, role, content, path, parent_message_id, 
-                       branch_id, created_at
-                FROM messages
-                WHERE thread_id = %s AND branch_id IS NULL
-                ORDER BY id ASC
-            """
-            cursor.execute(messages_query, (thread_id,))
-            messages = cursor.fetchall()
 
-            # Combine thread info with messages
-            thread['messages'] = messages
-            return thread
+    def get_thread_json(self, thread_id: int) -> Optional[str]:
+        """
+        A thread and only its MAIN thread messages (branch_id IS NULL), each with
+        'forks': [{branch_id, preview, created_at}, ...], wrapped as {"thread": ...} and
+        serialized by Postgres. The text goes to the client as-is, so the (often
+        large) message list is never decoded into dicts and encoded again in Python.
+        Returns None if the thread doesn't exist.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT json_build_object('thread', row_to_json(t))::text FROM (" + THREAD_WITH_MESSAGES_QUERY + ") t",
+                (thread_id,)
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     def get_threads_for_document(self, document_id: int) -> List[Dict]:
         """Retrieves all threads associated with a specific document, 
@@ -325,7 +650,7 @@ class DBManager:
             return cursor.fetchall()
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
     def create_space(self, name: str, description: str = None) -> int:
         """Creates a new workspace (e.g., 'Legal Team', 'Project Alpha')."""
         conn = self.get_connection()
@@ -338,7 +663,7 @@ class DBManager:
             return space_id
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     def get_spaces(self) -> List[Dict]:
         """Lists all available workspaces."""
@@ -349,7 +674,7 @@ class DBManager:
             return cursor.fetchall()
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
 
     def get_message_by_id(self, message_id: int) -> Optional[Dict]:
@@ -357,99 +682,82 @@ class DBManager:
         conn = self.get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         try:
-            cursor.execute("SELECT * FROM messages WHERE id = %s", (message_id,))
+            _execute_hot(cursor, "msg_by_id", (message_id,))
             return cursor.fetchone()
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
     # --- FORKING LOGIC (Fixed & Pooled) ---
-    def get_thread_forks(self, thread_id: int) -> Dict[int, List[Dict]]:
+    def get_branch_full_view(self, branch_start_message_id: int) -> List[Dict]:
         """
-        Retrieves all fork start messages for a thread, grouped by their parent message.
+        Fetches the linear conversation path for a specific branch:
+        Ancestors (last few, oldest first) -> Fork Start -> Children of Fork.
+        One pool checkout, one round-trip.
         """
         conn = self.get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         try:
             query = """
-                SELECT id, parent_message_id, content, created_at
-                FROM messages
-                WHERE thread_id = %s 
-                AND branch_id = id  -- Identifies start of a new branch
+                WITH start_msg AS (
+                    SELECT id, thread_id, branch_id, parent_message_id
+                    FROM messages
+                    WHERE id = %(start_id)s
+                ),
+                ancestors AS (
+                    SELECT m.*, 0 AS section
+                    FROM messages m
+                    WHERE m.id = ANY((
+                        SELECT p.ancestor_ids
+                        FROM messages p
+                        JOIN start_msg s ON p.id = s.parent_message_id
+                    ))
+                    ORDER BY m.id DESC
+                    LIMIT %(history_limit)s
+                )
+                SELECT * FROM ancestors
+                UNION ALL
+                SELECT m.*, 1 AS section
+                FROM messages m
+                JOIN start_msg s
+                  ON m.id = s.id
+                  OR (m.thread_id = s.thread_id AND m.branch_id = s.branch_id)
+                ORDER BY section, created_at, id
             """
-            cursor.execute(query, (thread_id,))
+            cursor.execute(query, {
+                "start_id": branch_start_message_id,
+                "history_limit": CONTEXT_HISTORY_LIMIT,
+            })
             rows = cursor.fetchall()
-        
-            forks_map = {}
             for row in rows:
-                parent_id = row['parent_message_id']
-                if parent_id not in forks_map:
-                    forks_map[parent_id] = []
-                
-                forks_map[parent_id].append({
-                    "branch_id": row['id'], 
-                    "preview": row['content'][:150], 
-                    "created_at": row['created_at']
-                })
-            return forks_map
+                del row['section']
+            return rows
         finally:
             cursor.close()
-            self.pool.putconn(conn) # Returns connection to pool
-
-    def get_branch_full_view(self, branch_start_message_id: int) -> List[Dict]:
-        """
-        Fetches the linear conversation path for a specific branch.
-        """
-        conn = self.get_connection()
-        # We need two cursors or separate executions. 
-        # Since we call other methods (get_message_by_id, get_context_messages) 
-        # which get their OWN connections from the pool, we only use this connection
-        # for the final specific query.
-        
-        try:
-            # 1. Fetch start message (This gets its own conn from pool temporarily)
-            start_msg = self.get_message_by_id(branch_start_message_id) 
-            if not start_msg:
-                return []
-
-            # 2. Get Ancestors (This gets its own conn from pool temporarily)
-            ancestors = self.get_context_messages(start_msg['parent_message_id'])
-
-            # 3. Get branch descendants using the current connection
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            branch_query = """
-                SELECT * FROM messages 
-                WHERE thread_id = %s AND branch_id = %s
-                ORDER BY created_at ASC
-            """
-            cursor.execute(branch_query, (start_msg['thread_id'], start_msg['branch_id']))
-            branch_descendants = cursor.fetchall()
-            cursor.close()
-
-            # Combine: Ancestors -> Fork Start -> Children of Fork
-            return ancestors + [start_msg] + branch_descendants
-        finally:
-            self.pool.putconn(conn) # Returns connection to pool
+            self.release_connection(conn) # Returns connection to pool
 
     def get_branch_messages_only(self, branch_start_message_id: int) -> List[Dict]:
         """
         Fetches only the messages in a branch (starting from the fork question),
         without including ancestor messages from the main thread.
+        Each message includes 'forks': [{branch_id, preview, created_at}, ...].
         """
         conn = self.get_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor = conn.cursor()
         try:
             # Get all messages with this branch_id (includes the fork start + descendants)
+            # Each message carries its own fork previews (branches from branches)
             query = """
-                SELECT id, thread_id, user_id, role, content, created_at, branch_id
-                FROM messages 
-                WHERE branch_id = %s
-                ORDER BY created_at ASC
+                SELECT m.id, m.thread_id, m.user_id, m.role, m.content, m.created_at, m.branch_id, f.forks
+                FROM messages m
+                """ + FORKS_LATERAL + """
+                WHERE m.branch_id = %s
+                ORDER BY m.created_at ASC
             """
             cursor.execute(query, (branch_start_message_id,))
-            return cursor.fetchall()
+            return [BranchMessageRow._make(row)._asdict() for row in cursor.fetchall()]
         finally:
             cursor.close()
-            self.pool.putconn(conn)
+            self.release_connection(conn)
 
 
@@ -1,6 +1,7 @@
 import mysql.connector
 from mysql.connector import errorcode
 import logging
+import re
 import sys
 import os
 from dotenv import load_dotenv
@@ -51,7 +52,7 @@ TABLES['documents'] = (
         space_id INT NOT NULL,
         filename VARCHAR(255) NOT NULL,
         file_type VARCHAR(50),
-        file_url TEXT, 
+        file_url VARCHAR(1024), 
 
         uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
 
@@ -107,7 +108,7 @@ TABLES['messages'] = (
         user_id INT NOT NULL, 
         role VARCHAR(20) NOT NULL,
         content TEXT NOT NULL, 
-        path TEXT NOT NULL,
+        path VARCHAR(512) NOT NULL,
         parent_message_id INT,
         branch_id INT DEFAULT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -120,23 +121,141 @@ TABLES['messages'] = (
     """
 )
 
-# 6. INDEXES
+# 6. MIGRATIONS
+# CREATE TABLE IF NOT EXISTS leaves older tables alone, so bring their column types
+# in line here. path must be a VARCHAR before it can be indexed in full, so these
+# run before the indexes. (table, column, target COLUMN_TYPE, DDL): the DDL only
+# runs while information_schema still reports another type, since a MODIFY takes a
+# metadata lock and may rebuild the table even when nothing changes.
+MIGRATIONS = [
+    ("messages", "path", "varchar(512)", "ALTER TABLE messages MODIFY path VARCHAR(512) NOT NULL"),
+    ("documents", "file_url", "varchar(1024)", "ALTER TABLE documents MODIFY file_url VARCHAR(1024)"),
+]
+
+# 7. INDEXES
 INDEXES = [
-    # Fast Path Search
-    "CREATE INDEX idx_messages_path ON messages (path(20));",
+    # Fast Path Search: full-width path (VARCHAR, not a 20-byte TEXT prefix) so
+    # ancestor/subtree lookups are answered from the index without row reads
+    "CREATE INDEX idx_messages_path_full ON messages (thread_id, path);",
 
-    # Fast Branch Lookup
-    "CREATE INDEX idx_messages_branching ON messages (thread_id, branch_id);",
+    # Fast Branch Lookup + "last message in branch" (ORDER BY id DESC LIMIT 1)
+    "CREATE INDEX idx_messages_last ON messages (thread_id, branch_id, id DESC);",
 
     # Fast Document/Page Lookup
     "CREATE INDEX idx_anchors_doc_page ON context_anchors (document_id, page_number);",
 
     # NEW: Fast Space lookups
-    "CREATE INDEX idx_documents_space ON documents (space_id);",
-    "CREATE INDEX idx_threads_space ON threads (space_id);"
+    # (space_id, filename) also serves plain space_id filters, so no single-column index
+    "CREATE INDEX idx_documents_space_filename ON documents (space_id, filename);",
+    "CREATE INDEX idx_threads_space ON threads (space_id);",
+
+    # "My threads" listings: creator first, then space, newest first
+    "CREATE INDEX idx_threads_creator_space ON threads (creator_user_id, space_id, id DESC);"
 ]
 
 
+INDEX_NAME_RE = re.compile(r'CREATE INDEX (\w+)')
+
+
+def existing_index_names(cur) -> set:
+    """One catalog query instead of one failed CREATE INDEX (error 1061) per existing index.
+    MySQL (unlike MariaDB/Postgres) has no CREATE INDEX IF NOT EXISTS."""
+    cur.execute(
+        "SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = %s",
+        (DB_NAME,)
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def existing_table_names(cur) -> set:
+    cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s", (DB_NAME,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def existing_column_types(cur) -> dict:
+    """(table, column) -> lower-case COLUMN_TYPE, e.g. ('messages', 'path') -> 'varchar(512)'."""
+    cur.execute(
+        "SELECT table_name, column_name, column_type FROM information_schema.columns WHERE table_schema = %s",
+        (DB_NAME,)
+    )
+    return {(table, column): column_type.lower() for table, column, column_type in cur.fetchall()}
+
+
+def build_schema_script(skip_tables: set = frozenset(), skip_indexes: set = frozenset(),
+                        column_types: dict = None) -> str:
+    """
+    Missing tables, pending migrations, then missing indexes, as one multi-statement
+    script. Without column_types every migration is included. Empty when the schema
+    is already current, so a warm run issues no DDL at all.
+    """
+    tables = [ddl for name, ddl in TABLES.items() if name not in skip_tables]
+    migrations = [
+        ddl for table, column, target_type, ddl in MIGRATIONS
+        if column_types is None or column_types.get((table, column)) != target_type
+    ]
+    indexes = [ddl for ddl in INDEXES if INDEX_NAME_RE.match(ddl).group(1) not in skip_indexes]
+    statements = tables + migrations + indexes
+    return ";\n".join(stmt.strip().rstrip(';') for stmt in statements)
+
+
+def execute_script(cur, script: str):
+    """
+    Runs a multi-statement script in one round-trip with whichever API the installed
+    driver has: execute(multi=True) before mysql-connector 9.2, map_results=True +
+    fetchsets() after. Every result is drained so the next statement runs.
+    """
+    try:
+        results = cur.execute(script, multi=True)
+    except TypeError:
+        cur.execute(script, map_results=True)
+        for _statement, _rows in cur.fetchsets():
+            pass
+        return
+    for result in results:
+        if result.with_rows:
+            result.fetchall()
+
+
+def create_tables_individually(cur):
+    """Per-statement DDL that tolerates existing tables/indexes."""
+    # 1. Create Tables
+    logger.info(f"Creating tables in database '{DB_NAME}'...")
+    # Iterating directly isn't guaranteed order in older Python versions,
+    # but in modern Python it inserts order. To be safe, we rely on the define order above.
+    for name, ddl in TABLES.items():
+        try:
+            logger.info(f"Processing table {name}...")
+            cur.execute(ddl)
+        except mysql.connector.Error as err:
+            if err.errno == errorcode.ER_TABLE_EXISTS_ERROR:
+                logger.warning(f"Table {name} already exists. Skipping.")
+            else:
+                logger.error(f"Error creating table {name}: {err}")
+                # If a critical table fails, we might want to stop
+                if name in ['spaces', 'documents', 'threads']:
+                    raise err
+
+    # 2. Apply Migrations
+    logger.info("Applying column migrations...")
+    for _table, _column, _target_type, ddl in MIGRATIONS:
+        try:
+            cur.execute(ddl)
+        except mysql.connector.Error as err:
+            logger.error(f"Error applying migration: {err}")
+
+    # 3. Create Indexes
+    logger.info("Creating indexes...")
+    for idx_ddl in INDEXES:
+        try:
+            cur.execute(idx_ddl)
+        except mysql.connector.Error as err:
+            # Error code 1061 is "Duplicate key/index name"
+            if err.errno == 1061:
+                logger.warning(f"Index already exists, skipping...")
+            else:
+                logger.error(f"Error creating index: {err}")
+
+
 def create_tables():
     conn = None
     cur = None
@@ -151,34 +270,27 @@ def create_tables():
         )
         cur = conn.cursor()
 
-        # 1. Create Tables
-        logger.info(f"Creating tables in database '{DB_NAME}'...")
-        # Iterating directly isn't guaranteed order in older Python versions,
-        # but in modern Python it inserts order. To be safe, we rely on the define order above.
-        for name, ddl in TABLES.items():
-            try:
-                logger.info(f"Processing table {name}...")
-                cur.execute(ddl)
-            except mysql.connector.Error as err:
-                if err.errno == errorcode.ER_TABLE_EXISTS_ERROR:
-                    logger.warning(f"Table {name} already exists. Skipping.")
-                else:
-                    logger.error(f"Error creating table {name}: {err}")
-                    # If a critical table fails, we might want to stop
-                    if name in ['spaces', 'documents', 'threads']:
-                        raise err
-
-        # 2. Create Indexes
-        logger.info("Creating indexes...")
-        for idx_ddl in INDEXES:
-            try:
-                cur.execute(idx_ddl)
-            except mysql.connector.Error as err:
-                # Error code 1061 is "Duplicate key/index name"
-                if err.errno == 1061:
-                    logger.warning(f"Index already exists, skipping...")
-                else:
-                    logger.error(f"Error creating index: {err}")
+        # Fast path: every missing CREATE/ALTER in one multi-statement round-trip.
+        # Tables, column types and indexes that are already in place are left out up
+        # front; if anything else fails we fall back to the per-statement loop below.
+        try:
+            # Three catalog reads decide what's missing; a warm run stops here
+            script = build_schema_script(
+                skip_tables=existing_table_names(cur),
+                skip_indexes=existing_index_names(cur),
+                column_types=existing_column_types(cur)
+            )
+            if not script:
+                logger.info(f"Schema in database '{DB_NAME}' is up to date; no DDL needed.")
+            else:
+                logger.info(f"Creating tables and indexes in database '{DB_NAME}' (batched)...")
+                execute_script(cur, script)
+        except (mysql.connector.Error, TypeError, AttributeError) as err:
+            # Also a driver API mismatch: the per-statement path only needs execute()
+            logger.warning(f"Batched DDL stopped ({err}); retrying statement by statement...")
+            cur.close()
+            cur = conn.cursor()
+            create_tables_individually(cur)
 
         # 3. Commit and Success
         conn.commit()
@@ -3,6 +3,7 @@ from fastapi import Depends
 from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable, SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy import Column, String, Integer, Boolean
 import os
 from dotenv import load_dotenv
@@ -20,8 +21,32 @@ DB_USER = os.getenv('POSTGRES_USER')
 DB_PASS = os.getenv('POSTGRES_PASSWORD')
 DB_PORT = int(os.getenv('POSTGRES_PORT', 6543))
 
-# Connection String for SQLAlchemy (Async) - PostgreSQL with SSL for Supabase
-DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?ssl=require"
+# Auth engine pool tuning. Keep POOL_SIZE + MAX_OVERFLOW under Supabase's connection cap.
+# SQLALCHEMY_NULLPOOL=true opens a connection per checkout and lets Supabase's
+# transaction-mode pooler (port 6543) do all the pooling instead.
+POOL_SIZE = int(os.getenv('POOL_SIZE', 20))
+MAX_OVERFLOW = int(os.getenv('MAX_OVERFLOW', 20))
+POOL_RECYCLE_SECONDS = int(os.getenv('POOL_RECYCLE', 1800))
+POOL_TIMEOUT_SECONDS = int(os.getenv('POOL_TIMEOUT', 30))
+USE_NULL_POOL = os.getenv('SQLALCHEMY_NULLPOOL', 'false').lower() == 'true'
+
+# Server-side safety nets (milliseconds, empty = server default): a stuck statement or a
+# session left "idle in transaction" is killed by Postgres instead of pinning a pooled
+# connection until the pool runs dry. Sent as startup parameters, so only set them
+# against the session endpoint (5432) or a direct connection: the transaction pooler
+# on 6543 rejects or drops them.
+SERVER_SETTINGS = {
+    name: value for name, value in {
+        "statement_timeout": os.getenv('DB_STATEMENT_TIMEOUT_MS', ''),
+        "idle_in_transaction_session_timeout": os.getenv('DB_IDLE_TX_TIMEOUT_MS', ''),
+    }.items() if value
+}
+
+# Connection String for SQLAlchemy (Async) - PostgreSQL with SSL for Supabase.
+# DATABASE_URL overrides it (e.g. a local database); this module is the single engine
+# definition for the auth tables, whatever the driver.
+DATABASE_URL = os.getenv('DATABASE_URL') or \
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}?ssl=require"
 
 class Base(DeclarativeBase):
     pass
@@ -32,13 +57,29 @@ class User(SQLAlchemyBaseUserTable[int], Base):
     full_name = Column(String(length=100), nullable=True)
     # The library automatically adds: email, hashed_password, is_active, etc.
 
-engine = create_async_engine(
-    DATABASE_URL,
-    connect_args={
+if USE_NULL_POOL:
+    pool_args = {"poolclass": NullPool}
+else:
+    pool_args = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_pre_ping": True,                 # Drop connections the pooler closed while idle
+        "pool_recycle": POOL_RECYCLE_SECONDS,
+        "pool_timeout": POOL_TIMEOUT_SECONDS,
+    }
+
+# asyncpg-only options; other async drivers get their defaults
+if DATABASE_URL.startswith("postgresql+asyncpg"):
+    connect_args = {
         "prepared_statement_cache_size": 0,  # Disables prepared statements
         "statement_cache_size": 0,           # Ensures no caching happens
+        "server_settings": SERVER_SETTINGS,
+        "timeout": int(os.getenv('DB_CONNECT_TIMEOUT', 5)),  # connect timeout (asyncpg default: 60s)
     }
-)
+else:
+    connect_args = {}
+
+engine = create_async_engine(DATABASE_URL, connect_args=connect_args, **pool_args)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
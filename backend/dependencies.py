@@ -1,13 +1,62 @@
 # backend/dependencies.py
 import os
-from advanced_rag import AdvancedRAGSystem
-from database_manager import DBManager
+import threading
 from chat_controller import ChatController
 from handlers import OmarHandlers
 
+# Importing this module (and so rag_server) has no side effects: the parse worker
+# processes (spawn) re-import the server's main module, and must not open a DB pool
+# or load models of their own. Both managers are built on first use instead.
+
 # 1. Initialize Managers
-db_manager = DBManager()
-rag_system = AdvancedRAGSystem()
+# DBManager opens DB_POOL_MIN connections as soon as it is created.
+_db_manager = None
+_db_lock = threading.Lock()
+
+
+def get_db_manager():
+    global _db_manager
+    if _db_manager is None:
+        with _db_lock:
+            if _db_manager is None:
+                from database_manager import DBManager
+                _db_manager = DBManager()
+    return _db_manager
+
+
+# AdvancedRAGSystem loads the cross-encoder and builds the LLM/embedding clients, which
+# takes seconds. Build it on first use (or from the lifespan warm-up) instead of at
+# import time, so workers start fast and a model-load failure doesn't break the import.
+_rag_system = None
+_rag_lock = threading.Lock()
+
+
+def get_rag_system():
+    global _rag_system
+    if _rag_system is None:
+        with _rag_lock:
+            if _rag_system is None:
+                from advanced_rag import AdvancedRAGSystem
+                _rag_system = AdvancedRAGSystem()
+    return _rag_system
+
+
+def rag_system_ready() -> bool:
+    return _rag_system is not None
+
+
+class _Lazy:
+    """Stand-in that forwards every attribute to the real object, building it on first access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+db_manager = _Lazy(get_db_manager)
+rag_system = _Lazy(get_rag_system)
 
 # 3. Initialize Controllers
 handler = OmarHandlers(db_manager=db_manager)
@@ -16,5 +65,3 @@ chat_controller = ChatController(db_manager=db_manager, rag_system=rag_system)
 # 4. Shared Constants
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 STORAGE_DIR = os.path.join(BASE_DIR, "backend", "storage")
-if not os.path.exists(STORAGE_DIR):
-    os.makedirs(STORAGE_DIR)
\ No newline at end of file
@@ -1,10 +1,14 @@
 import logging
+import re
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import unquote
 
 # Setup logging
 logger = logging.getLogger("ChatState")
 
+# Legacy uploads went through a local "temp_<name>" file; only the leading prefix is noise.
+_TEMP_PREFIX_RE = re.compile(r'^temp_')
+
 
 class OmarHandlers:
     """
@@ -16,15 +20,10 @@ class OmarHandlers:
     def __init__(self, db_manager):
         self.db = db_manager
 
-    def ensure_thread(self, user_id: int, query_text: str,space_id: int, thread_id: int = None) -> int:
-        """Creates a new thread if needed, or validates the existing one."""
-        if not thread_id:
-            # Create Title from query
-            title_snippet = (query_text[:47] + '...') if len(query_text) > 47 else query_text
-            thread_id = self.db.create_thread(title=title_snippet, creator_id=user_id, space_id=space_id)
-            logger.info(f"Created new thread ID: {thread_id}")
-            return thread_id
-        return thread_id
+    @staticmethod
+    def thread_title(query_text: str) -> str:
+        """Title for a new thread: the opening query, cut to 50 characters."""
+        return (query_text[:47] + '...') if len(query_text) > 47 else query_text
 
     def resolve_parent_message(self, thread_id: int, requested_parent_id: int = None, branch_id: int = None) -> Optional[int]:
         """
@@ -48,17 +47,6 @@ class OmarHandlers:
         last_msg_id = self.db.get_last_message_id(thread_id, branch_id)
         return last_msg_id
 
-    def log_user_message(self, thread_id: int, user_id: int, content: str, parent_id: Optional[int], is_fork: bool) -> int:
-        """Saves the user's input to DB."""
-        return self.db.add_message(
-            thread_id=thread_id,
-            user_id=user_id,
-            role="user",
-            content=content,
-            parent_message_id=parent_id,
-            is_fork_start=is_fork
-        )
-
     def get_chat_history(self, parent_id: int) -> List[Dict]:
         """Fetches context for the AI."""
         if not parent_id:
@@ -68,28 +56,46 @@ class OmarHandlers:
         logger.info(f"Fetched {len(history)} messages of history context.")
         return history
 
-    def log_ai_response(self, thread_id: int, content: str, parent_id: int) -> int:
-        """Saves the AI's output to DB."""
-        return self.db.add_message(
+    def log_exchange(self, thread_id: Optional[int], user_id: int, query_text: str, ai_text: str,
+                     parent_id: Optional[int], is_fork: bool,
+                     anchor_document_id: Optional[int] = None,
+                     space_id: Optional[int] = None) -> Tuple[int, int, int]:
+        """
+        Saves the user's input and the AI's reply together (one transaction), plus the
+        thread's document anchor when anchor_document_id is given. With thread_id=None
+        the thread (in space_id, titled from the query) is created in the same write.
+        Returns (thread_id, user_message_id, ai_message_id).
+        """
+        new_thread = thread_id is None
+        thread_id, user_msg_id, ai_msg_id = self.db.add_exchange(
             thread_id=thread_id,
-            user_id=0,  # System ID
-            role="assistant",
-            content=content,
+            user_id=user_id,
+            user_content=query_text,
+            ai_content=ai_text,
             parent_message_id=parent_id,
-            is_fork_start=False  # AI never starts a fork
+            is_fork_start=is_fork,
+            anchor_document_id=anchor_document_id,
+            space_id=space_id,
+            thread_title=self.thread_title(query_text) if new_thread else None
         )
+        if new_thread:
+            logger.info(f"Created new thread ID: {thread_id}")
+        if anchor_document_id:
+            logger.info(f"Anchored Thread {thread_id} to Document {anchor_document_id}")
+        return thread_id, user_msg_id, ai_msg_id
 
-    def anchor_thread_to_document(self, thread_id: int, source_filename: str, space_id: int):
-        """Links the thread to the document used by RAG."""
+    def resolve_anchor_document(self, source_filename: str, space_id: int) -> Optional[int]:
+        """Finds the documents row behind the filename RAG cited (None if unknown)."""
         if not source_filename:
-            return
+            return None
 
-        # URL-decode the filename (e.g., "RAG%20Test.pdf" -> "RAG Test.pdf")
-        clean_filename = unquote(source_filename.replace("temp_", ""))
+        # New chunks carry the decoded filename already; older ones may still be
+        # URL-encoded (e.g., "RAG%20Test.pdf" -> "RAG Test.pdf"), so decode only then.
+        clean_filename = _TEMP_PREFIX_RE.sub('', source_filename, count=1)
+        if '%' in clean_filename:
+            clean_filename = unquote(clean_filename)
         doc_id = self.db.get_document_id_by_filename(space_id, clean_filename)
 
-        if doc_id:
-            self.db.link_thread_to_doc(thread_id, doc_id, page_num=1)
-            logger.info(f"Anchored Thread {thread_id} to Document {doc_id}")
-        else:
-            logger.warning(f"Could not anchor thread: Document '{clean_filename}' not found in DB.")
\ No newline at end of file
+        if not doc_id:
+            logger.warning(f"Could not anchor thread: Document '{clean_filename}' not found in DB.")
+        return doc_id
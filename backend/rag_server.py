@@ -1,16 +1,22 @@
 import os
+import asyncio
+import hashlib
 import logging
 import contextlib
-from fastapi import FastAPI
+import anyio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse
 
 # Import Routers
 from routers import chat, documents, spaces
 # Import Auth
 from users import auth_backend, fastapi_users
 from schemas import UserRead, UserCreate, UserUpdate
+from dependencies import get_db_manager, get_rag_system, rag_system_ready
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
@@ -19,20 +25,31 @@ logger = logging.getLogger("RAG_Server")
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 FRONTEND_DIST = os.path.join(BASE_DIR, "frontend", "dist")
 
+# Chat turns run in asyncio.to_thread (blocking retrieval + LLM HTTP calls), so the
+# default executor bounds how many can be in flight at once
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', 64))
+
 # Lifespan event to create Auth Tables on startup and cleanup on shutdown
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="to-thread")
+    )
+    # Plain 'def' endpoints run on AnyIO's threadpool
+    # instead, which defaults to 40 threads; give it the same budget
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREAD_POOL_SIZE
+
     # Startup: Create the Auth Tables (Users) if they don't exist
     # NOTE: You can skip this if you've already run supabase_sql_setup.py
     SKIP_AUTH_TABLE_CREATION = os.getenv('SKIP_AUTH_TABLE_CREATION', 'false').lower() == 'true'
     
     if not SKIP_AUTH_TABLE_CREATION:
-        from db import engine, Base, DATABASE_URL
+        from db import DATABASE_URL
+        from create_auth_tables import init_models
         try:
             logger.info("Connecting to database and creating auth tables...")
             logger.info(f"Database URL: {DATABASE_URL.replace(DATABASE_URL.split('@')[0].split('//')[1], '***')}")
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+            await init_models()
             logger.info("✅ Database connection successful and auth tables ready")
         except Exception as e:
             logger.error(f"❌ Database connection failed: {e}")
@@ -42,6 +59,23 @@ async def lifespan(app: FastAPI):
     else:
         logger.info("⏭️  Skipping auth table creation (SKIP_AUTH_TABLE_CREATION=true)")
     
+    # Open the chat DB pool now (dependencies builds it lazily, so that importing this
+    # module stays side-effect free); a bad configuration still fails at startup
+    await asyncio.to_thread(get_db_manager)
+
+    # Warm the RAG system (models + clients) off the event loop; requests are served meanwhile
+    def _log_warmup(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"❌ RAG system warm-up failed: {task.exception()}")
+        else:
+            logger.info("RAG system ready")
+
+    def _warm_rag_system():
+        get_rag_system().warm_up()
+
+    rag_warmup = asyncio.create_task(asyncio.to_thread(_warm_rag_system))
+    rag_warmup.add_done_callback(_log_warmup)
+
     logger.info("Application started successfully")
     
     yield  # Server runs here
@@ -54,7 +88,8 @@ async def lifespan(app: FastAPI):
         logger.info("Database connections closed")
 
 # --- FastAPI App ---
-app = FastAPI(title="Clark", lifespan=lifespan)
+# orjson serializes the large thread/branch payloads (datetimes included) much faster than stdlib json
+app = FastAPI(title="Clark", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -65,6 +100,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Thread/branch message lists are repetitive text and compress well; tiny bodies aren't worth it
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # --- 1. MOUNT AUTH ROUTERS ---
 # Login/Logout
 app.include_router(
@@ -97,18 +135,71 @@ app.include_router(documents.router, prefix="/api", tags=["documents"])
 app.include_router(spaces.router, prefix="/api", tags=["spaces"])
 
 
+@app.get("/healthz")
+async def healthz():
+    health = {"status": "ok", "rag_ready": rag_system_ready()}
+    if health["rag_ready"]:
+        # Device the reranker landed on (cuda / mps / cpu)
+        health["rag_backend"] = get_rag_system().backend
+    return health
+
+
 # --- 3. SERVE FRONTEND ---
-@app.get("/")
-async def read_root():
+class FrontendStaticFiles(StaticFiles):
+    """
+    Vite build output: files under assets/ carry a content hash in their name, so
+    browsers may keep them forever. Everything else (index.html, favicon, ...) is
+    revalidated so a new deploy is picked up on the next load.
+    """
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            if path.startswith("assets/"):
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+def _load_index_html():
+    """index.html only changes with a deploy (= a restart), so it is read once at import."""
     index_path = os.path.join(FRONTEND_DIST, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path, media_type="text/html")
-    return {"message": "Clark API Server Running"}
+    if not os.path.exists(index_path):
+        return None, None
+    with open(index_path, "rb") as f:
+        body = f.read()
+    return body, '"' + hashlib.md5(body).hexdigest() + '"'
+
+
+INDEX_HTML, INDEX_HTML_ETAG = _load_index_html()
+
+
+@app.get("/")
+async def read_root(request: Request):
+    # Served from memory: no stat or file read on the event loop per visit
+    if INDEX_HTML is None:
+        return {"message": "Clark API Server Running"}
+    headers = {"Cache-Control": "no-cache", "ETag": INDEX_HTML_ETAG}
+    if INDEX_HTML_ETAG in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(INDEX_HTML, headers=headers)
 
 if os.path.isdir(FRONTEND_DIST):
-    app.mount("/", StaticFiles(directory=FRONTEND_DIST, html=True), name="frontend")
+    app.mount("/", FrontendStaticFiles(directory=FRONTEND_DIST, html=True), name="frontend")
 
 if __name__ == "__main__":
     import uvicorn
     print("Starting Clark...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # loop/http "auto" use uvloop + httptools when installed (uvicorn[standard]; not on Windows).
+    # Every worker is a separate process with its own models and in-memory caches, and
+    # cache invalidation is per process (other workers' answer caches only catch up
+    # when their entries expire, see RESPONSE_CACHE_TTL), so the default stays at one worker.
+    uvicorn.run(
+        "rag_server:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv('WEB_CONCURRENCY', 1)),
+    )
\ No newline at end of file
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, Query, Depends, HTTPException
+import asyncio
+import threading
+import anyio
+import orjson
+from fastapi import APIRouter, Query, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from dependencies import chat_controller, db_manager
-from users import current_active_user, User 
+from users import current_active_user, current_active_user_released, User 
 
 router = APIRouter()
 
@@ -22,11 +27,13 @@ class MessageRequest(BaseModel):
 async def chat(
     request: QueryRequest, 
     space_id: int = Query(1),
-    user: User = Depends(current_active_user)
+    user: User = Depends(current_active_user_released)
 ):
     try:
 
-        result = chat_controller.process_user_query(
+        # Retrieval + LLM are blocking HTTP calls; keep them off the event loop
+        result = await asyncio.to_thread(
+            chat_controller.process_user_query,
             query_text=request.text,
             user_id=user.id, 
             thread_id=request.thread_id,
@@ -38,15 +45,70 @@ async def chat(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/stream")
+def chat_stream(
+    request: QueryRequest, 
+    space_id: int = Query(1),
+    user: User = Depends(current_active_user_released)
+):
+    """
+    /chat as Server-Sent Events: 'data: {"token": ...}' while the answer is generated,
+    then one 'data: {"done": true, ...}' event carrying the usual /chat response fields.
+    """
+    events = chat_controller.stream_user_query(
+        query_text=request.text,
+        user_id=user.id,
+        thread_id=request.thread_id,
+        space_id=space_id,
+        is_fork=False,
+        branch_id=request.branch_id
+    )
+
+    # Steps and the final close of the turn run on worker threads; the lock keeps a close
+    # from racing a step that is still in flight when the client goes away.
+    turn_lock = threading.Lock()
+
+    def step():
+        with turn_lock:
+            return next(events, None)
+
+    def finish():
+        with turn_lock:
+            events.close()
+
+    async def sse():
+        # One event per token, so orjson (same encoder as the JSON endpoints) straight to bytes.
+        try:
+            while (event := await asyncio.to_thread(step)) is not None:
+                kind, value = event
+                if kind == "token":
+                    yield b"data: " + orjson.dumps({'token': value}) + b"\n\n"
+                else:
+                    yield b"data: " + orjson.dumps({'done': True, **value}) + b"\n\n"
+        except Exception as e:
+            yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+        finally:
+            # A client disconnect cancels this generator (or leaves it to the loop's asyncgen
+            # finalizer). Either way the turn is closed off the event loop, where it logs the
+            # partial exchange; shielded because AnyIO re-cancels every await in a cancelled scope.
+            with anyio.CancelScope(shield=True):
+                await asyncio.to_thread(finish)
+
+    # Tell proxies (nginx) not to buffer the stream, or tokens arrive all at once
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.post("/threads/{thread_id}/branch")
 async def branch_from_message(
     thread_id: int, 
     request: BranchRequest, 
     space_id: int = Query(1),
-    user: User = Depends(current_active_user)
+    user: User = Depends(current_active_user_released)
 ):
     try:
-        result = chat_controller.process_user_query(
+        # Retrieval + LLM are blocking HTTP calls; keep them off the event loop
+        result = await asyncio.to_thread(
+            chat_controller.process_user_query,
             query_text=request.content,
             user_id=user.id,
             space_id=space_id,
@@ -59,28 +121,22 @@ async def branch_from_message(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# The read endpoints below only make blocking psycopg2 calls, so they are plain
+# 'def': FastAPI runs them in its worker threadpool instead of on the event loop.
 @router.get("/threads/{thread_id}")
-async def get_thread(
+def get_thread(
     thread_id: int,
     user: User = Depends(current_active_user)
 ):
     try:
-        # 1. Get the standard linear thread
-        thread = db_manager.get_thread_with_messages(thread_id)
-        if not thread:
+        # Main-thread messages, each already carrying its fork previews
+        # (msg['forks'], so the frontend can check forks.length > 0 to show the icon).
+        # The body is serialized by Postgres and passed through untouched.
+        payload = db_manager.get_thread_json(thread_id)
+        if not payload:
             raise HTTPException(status_code=404, detail="Thread not found")
-        
-        # 2. Get the fork/branch previews (Optimized separate query)
-        # Returns: { parent_msg_id: [ {branch_id, preview, created_at}, ... ] }
-        forks_map = db_manager.get_thread_forks(thread_id)
-
-        # 3. Inject fork data into the messages list for the frontend
-        if 'messages' in thread:
-            for msg in thread['messages']:
-                # The frontend can checks if msg['forks'].length > 0 to show the icon
-                msg['forks'] = forks_map.get(msg['id'], [])
 
-        return {"thread": thread}
+        return Response(content=payload, media_type="application/json")
     except HTTPException:
         raise
     except Exception as e:
@@ -88,7 +144,7 @@ async def get_thread(
 
 
 @router.get("/branches/{branch_id}")
-async def get_branch_conversation(
+def get_branch_conversation(
     branch_id: int,
     user: User = Depends(current_active_user)
 ):
@@ -104,27 +160,16 @@ async def get_branch_conversation(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/branches/{branch_id}/messages")
-async def get_branch_messages_only(
+def get_branch_messages_only(
     branch_id: int,
     user: User = Depends(current_active_user)
 ):
     """Returns only the branch messages without ancestor context."""
     try:
+        # Each message carries its fork/branch previews so the frontend can show
+        # "Dig Deeper" indicators for sub-branches (branches from branches).
         messages = db_manager.get_branch_messages_only(branch_id)
-        
-        # IMPORTANT: Attach fork/branch data to each message so the frontend can display
-        # branch indicators. This allows users to see and navigate to sub-branches that
-        # were created from messages within this branch (branches from branches).
-        # Without this, the branch view wouldn't show any "Dig Deeper" indicators.
-        if messages:
-            thread_id = messages[0]['thread_id']
-            # Get fork/branch previews for this thread
-            forks_map = db_manager.get_thread_forks(thread_id)
-            
-            # Inject fork data into messages
-            for msg in messages:
-                msg['forks'] = forks_map.get(msg['id'], [])
-        
+
         return {
             "branch_id": branch_id,
             "messages": messages
@@ -137,19 +182,17 @@ async def get_branch_messages_only(
 # Use cases: Manual logging, multi-step input, testing, annotations.
 @router.post("/threads/{thread_id}/messages")
 
-async def add_message_to_thread(
+def add_message_to_thread(
     thread_id: int, 
     request: MessageRequest,
     user: User = Depends(current_active_user)
 ):
     try:
-        parent_msg_id = db_manager.get_last_message_id(thread_id)
-        message_id = db_manager.add_message(
+        # Parent (last main-thread message) is resolved inside the INSERT
+        message_id = db_manager.append_message(
             thread_id=thread_id,
             user_id=user.id,
-            role="user",
-            content=request.content,
-            parent_message_id=parent_msg_id
+            content=request.content
         )
         return {"status": "success", "message_id": message_id}
     except Exception as e:
@@ -1,10 +1,15 @@
 import os
-# import shutil  # UNUSED
-import sys
-from fastapi import APIRouter, UploadFile, File, Query, HTTPException, Depends
-from fastapi.responses import FileResponse
-from dependencies import rag_system, db_manager, STORAGE_DIR
-from users import current_active_user
+import asyncio
+import hashlib
+import shutil
+import tempfile
+from functools import lru_cache
+from typing import List
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Query, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse, ORJSONResponse
+import orjson
+from dependencies import rag_system, db_manager, chat_controller
+from users import current_active_user, current_active_user_released
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -16,90 +21,250 @@ router = APIRouter()
 # SUPABASE CONFIGURATION
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-if not SUPABASE_URL:
-    print("Error: SUPABASE_URL not found in .env or environment variables.")
-    sys.exit(1)
-if not SUPABASE_KEY:
-    print("Error: SUPABASE_KEY not found in .env or environment variables.")
-    sys.exit(1)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 BUCKET_NAME = "course-materials" # Ensure this bucket exists and is set to PUBLIC in Supabase
+UPLOAD_COPY_CHUNK = 1 << 20  # 1 MiB
+PDF_MAGIC = b"%PDF-"
+# Uploads up to this size are kept in memory for storage and parsing; larger ones go
+# through a temp file so a few big PDFs can't pin hundreds of MiB until indexed
+UPLOAD_IN_MEMORY_MAX = int(os.getenv('UPLOAD_IN_MEMORY_MAX', 16 << 20))
 
-@router.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...), 
-    space_id: int = Query(1),
-    user = Depends(current_active_user)
-):
+
+@lru_cache(maxsize=1)
+def _create_storage_client() -> Client:
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+def get_supabase() -> Client:
+    """
+    The storage client, created on first use rather than at import, so the app (and
+    the routes that don't touch storage) can start without Supabase settings.
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise HTTPException(status_code=503, detail="Storage unavailable: SUPABASE_URL / SUPABASE_KEY not set")
+    return _create_storage_client()
+
+
+def _upload_to_storage(space_id: int, filename: str, upload_stream, content_type: str = "application/pdf",
+                       size: int = None):
+    """
+    Uploads the PDF to Supabase storage. Returns (public_url, local_path, pdf_bytes):
+    exactly one of the last two holds the PDF for indexing (a temp file, which
+    indexing deletes when done, or the bytes of a small upload).
+    """
+    # 2. Upload to Supabase
+    # We use a folder structure: space_id/filename
+    file_path_in_bucket = f"space_{space_id}/{filename}"
+    
+    print(f"Uploading to Supabase: {file_path_in_bucket}...")
+    
+    pdf_bytes = local_path = None
+    if size is not None and size <= UPLOAD_IN_MEMORY_MAX:
+        # Small PDF: one read, then storage and the parser both work from memory
+        pdf_bytes = upload_stream.read()
+    else:
+        # Copy the request body to a temp file in 1 MiB pieces and hand storage the path:
+        # it streams the file from disk, so a large PDF is never held in memory as bytes
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+            shutil.copyfileobj(upload_stream, temp_file, UPLOAD_COPY_CHUNK)
+        local_path = temp_file.name
     try:
-        # 1. Read file content
-        file_content = await file.read()
-        
-        # 2. Upload to Supabase
-        # We use a folder structure: space_id/filename
-        file_path_in_bucket = f"space_{space_id}/{file.filename}"
-        
-        print(f"Uploading to Supabase: {file_path_in_bucket}...")
-        
         # 'upsert=True' overwrites if exists
-        supabase.storage.from_(BUCKET_NAME).upload(
+        storage = get_supabase().storage.from_(BUCKET_NAME)
+        storage.upload(
             path=file_path_in_bucket, 
-            file=file_content,
-            file_options={"content-type": "application/pdf", "upsert": "true"}
+            file=pdf_bytes if pdf_bytes is not None else local_path,
+            file_options={"content-type": content_type, "upsert": "true"}
         )
 
         # 3. Get Public URL
-        public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(file_path_in_bucket)
+        public_url = storage.get_public_url(file_path_in_bucket)
         print(f"File accessible at: {public_url}")
+    except Exception:
+        _discard_local_copy(local_path)
+        raise
+    return public_url, local_path, pdf_bytes
 
+
+def _discard_local_copy(local_path: str = None):
+    """For uploads no indexing job will pick up."""
+    if local_path and os.path.exists(local_path):
+        os.remove(local_path)
+
+
+def _store_upload(space_id: int, filename: str, upload_stream, content_type: str = "application/pdf",
+                  size: int = None):
+    """
+    Uploads the PDF to Supabase storage and registers it. Returns (public_url, db_id,
+    local_path, pdf_bytes), see _upload_to_storage.
+    """
+    public_url, local_path, pdf_bytes = _upload_to_storage(space_id, filename, upload_stream, content_type, size)
+    try:
         # 4. Save to Database
         db_id = db_manager.add_document(
             space_id=space_id, 
-            filename=file.filename, 
+            filename=filename, 
             file_type='pdf', 
-            file_url=public_url  # Storing the HTTP Link
+            file_url=public_url,  # Storing the HTTP Link
+            status='indexing'
         )
+    except Exception:
+        _discard_local_copy(local_path)
+        raise
+    return public_url, db_id, local_path, pdf_bytes
+
+
+async def _require_pdf(file: UploadFile):
+    """415 for anything that doesn't start with the PDF signature, before it is stored or parsed."""
+    head = await file.read(len(PDF_MAGIC))
+    await file.seek(0)
+    if head != PDF_MAGIC:
+        raise HTTPException(status_code=415, detail=f"Not a PDF: {file.filename}")
+
 
-        # 5. Process RAG (Pass the URL directly)
-        # The updated function in advanced_rag.py now downloads from this URL
-        docs = rag_system.load_and_process_pdf(public_url,db_id, space_id)
+def _index_document(public_url: str, db_id: int, space_id: int, local_path: str = None,
+                    pdf_bytes: bytes = None):
+    """Background half of an upload: chunk, contextualize and embed, then flip the status."""
+    try:
+        # Parses the copy we just uploaded (and deletes it) instead of downloading it back
+        docs = rag_system.load_and_process_pdf(public_url, db_id, space_id,
+                                               local_path=local_path, pdf_bytes=pdf_bytes)
         rag_system.build_index(docs)
+        # New material in this space can change answers to questions asked before
+        chat_controller.invalidate_space(space_id)
+        db_manager.set_document_status(db_id, 'ready')
+    except Exception as e:
+        print(f"Indexing failed for document {db_id}: {e}")
+        db_manager.set_document_status(db_id, 'failed')
 
-        
-        return {"status": "success", "document_id": db_id, "url": public_url}
-    
+
+@router.post("/upload", status_code=202)
+async def upload_file(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...), 
+    space_id: int = Query(1),
+    user = Depends(current_active_user_released)
+):
+    await _require_pdf(file)
+    try:
+        # 1-4. The body (already spooled by Starlette), storage upload and DB row are
+        # blocking I/O: run them on a worker thread so a large PDF doesn't stall every
+        # other request on the loop
+        public_url, db_id, local_path, pdf_bytes = await asyncio.to_thread(
+            _store_upload, space_id, file.filename, file.file, file.content_type or "application/pdf",
+            file.size
+        )
+
+        # 5. Process RAG after the response is sent (embedding dominates upload time);
+        # poll /documents/{id}/status for 'ready' or 'failed'
+        background_tasks.add_task(_index_document, public_url, db_id, space_id, local_path, pdf_bytes)
+
+        return {"status": "accepted", "document_id": db_id, "url": public_url}
+
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/upload/batch", status_code=202)
+async def upload_files(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    space_id: int = Query(1),
+    user = Depends(current_active_user_released)
+):
+    """
+    /upload for several PDFs (e.g. a dropped folder): the storage uploads run in
+    parallel, then all documents rows are written in one round-trip.
+    """
+    # All or nothing: reject the batch before any file is stored
+    for file in files:
+        await _require_pdf(file)
+
+    stored = []
+    try:
+        stored = await asyncio.gather(*(
+            asyncio.to_thread(
+                _upload_to_storage, space_id, file.filename, file.file,
+                file.content_type or "application/pdf", file.size
+            )
+            for file in files
+        ), return_exceptions=True)
+        failed = [result for result in stored if isinstance(result, BaseException)]
+        if failed:
+            raise failed[0]
+
+        doc_ids = await asyncio.to_thread(
+            db_manager.add_documents,
+            space_id,
+            [(file.filename, 'pdf', public_url) for file, (public_url, _, _) in zip(files, stored)],
+            'indexing'
+        )
+    except Exception as e:
+        for result in stored:
+            if not isinstance(result, BaseException):
+                _discard_local_copy(result[1])
+        if isinstance(e, HTTPException):
+            raise
+        print(f"Upload failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    documents = []
+    for file, (public_url, local_path, pdf_bytes) in zip(files, stored):
+        db_id = doc_ids[file.filename]
+        background_tasks.add_task(_index_document, public_url, db_id, space_id, local_path, pdf_bytes)
+        documents.append({"document_id": db_id, "filename": file.filename, "url": public_url})
+    return {"status": "accepted", "documents": documents}
+
 @router.get("/documents")
-async def get_documents(
+def get_documents(
+    request: Request,
     space_id: int = Query(1),
     user = Depends(current_active_user)
 ):
-    return {"documents": db_manager.get_documents_for_space(space_id)}
+    # Serialize once (orjson handles the datetimes) and hash the exact bytes we send
+    body = orjson.dumps({"documents": db_manager.get_documents_for_space(space_id)})
+    # The sidebar re-polls this list; an unchanged list costs a bodiless 304
+    etag = '"' + hashlib.md5(body).hexdigest() + '"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+@router.get("/documents/{doc_id}/status")
+def get_document_status(
+    doc_id: int,
+    user = Depends(current_active_user)
+):
+    status = db_manager.get_document_status(doc_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"document_id": doc_id, "status": status}
 
 @router.get("/documents/{doc_id}/content")
-async def get_document_content(
+def get_document_content(
     doc_id: int,
     space_id: int = Query(1),
     user = Depends(current_active_user)
 ):
-    docs = db_manager.get_documents_for_space(space_id)
-    target_doc = next((d for d in docs if d['id'] == doc_id), None)
-    
+    target_doc = db_manager.get_document_by_id(doc_id, space_id)
+
     if not target_doc:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    return {
-        "url": target_doc['file_url'], 
-        "type": "external", 
-        "filename": target_doc['filename']
-    }
+    # The PDF bytes are served by Supabase storage, not by us. Its public URL is
+    # derived from (space, filename) and never changes for a document id, so the
+    # browser may reuse this lookup instead of asking again on every open.
+    return ORJSONResponse(
+        {
+            "url": target_doc['file_url'], 
+            "type": "external", 
+            "filename": target_doc['filename']
+        },
+        headers={"Cache-Control": "private, max-age=3600"}
+    )
 
 @router.get("/documents/{doc_id}/threads")
-async def get_document_threads(
+def get_document_threads(
     doc_id: int,
     user = Depends(current_active_user)
 ):
@@ -2,6 +2,9 @@ from typing import Optional
 from fastapi_users import schemas
 from pydantic import field_validator
 
+# Registration is limited to this college's addresses (change it for your college)
+ALLOWED_EMAIL_DOMAIN = "@eng.asu.edu.eg"
+
 # 1. User Read Schema (Output)
 class UserRead(schemas.BaseUser[int]):
     full_name: Optional[str]
@@ -13,11 +16,8 @@ class UserCreate(schemas.BaseUserCreate):
     @field_validator("email")
     @classmethod
     def validate_college_email(cls, v: str) -> str:
-        # Change this string to your specific college domain
-        allowed_domain = "@eng.asu.edu.eg"
-        
-        if not v.endswith(allowed_domain):
-            raise ValueError(f"Registration is restricted to {allowed_domain} emails only.")
+        if not v.endswith(ALLOWED_EMAIL_DOMAIN):
+            raise ValueError(f"Registration is restricted to {ALLOWED_EMAIL_DOMAIN} emails only.")
         return v
 
 # 3. User Update Schema (Profile Edit)
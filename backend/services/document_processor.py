@@ -1,25 +1,199 @@
 import os
+import re
+import json
 import time
 import random
+import shutil
+import hashlib
+import threading
 import requests
 import tempfile
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from typing import List, Optional
+from urllib.parse import unquote
+import pymupdf
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # Configuration Constants
-CHUNK_SIZE = 800
-CHUNK_OVERLAP = 150
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 800))  # characters
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB reads when fetching the PDF
+DOWNLOAD_POOL_SIZE = 16        # Keep-alive connections kept per storage host
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', 150))
+# Where the splitter may cut, in order of preference:
+# - paragraph: paragraphs, then lines, then sentences, then words (fewest ragged chunks)
+# - sentence: never prefer a line break over a sentence end (hard-wrapped PDFs)
+# - fixed: plain character windows
+CHUNK_SEPARATORS = {
+    "paragraph": ["\n\n", "\n", ". ", " ", ""],
+    "sentence": ["\n\n", ". ", "? ", "! ", "\n", " ", ""],
+    "fixed": [""],
+}
+CHUNK_STRATEGY = os.getenv('CHUNK_STRATEGY', 'paragraph').lower()
+# MuPDF isn't thread-safe and holds the GIL while extracting, so threads can't speed
+# parsing up. Long PDFs are split into page ranges over worker processes instead,
+# each opening its own copy; short ones aren't worth the hand-off.
+PARSE_PARALLEL_MIN_PAGES = int(os.getenv('PARSE_PARALLEL_MIN_PAGES', 200))
+PARSE_MAX_WORKERS = int(os.getenv('PARSE_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+# Contextual retrieval (an LLM-written context line per chunk) is off by default: on
+# Groq's free tier it hits 429s on any sizeable upload. CONTEXT_INJECTION=true turns on
+# the global-summary strategy for short documents and the block strategy for long ones.
+CONTEXT_INJECTION = os.getenv('CONTEXT_INJECTION', 'false').lower() == 'true'
 # Threshold: 30k chars is roughly 7.5k tokens. 
 # Groq's Llama-3.3-70b free tier often has a 6k-30k TPM limit.
 CONTEXT_THRESHOLD_CHARS = 23000 
+# The document summary is built once per PDF and reused for every chunk,
+# so we can afford to let it read more of the document than a per-chunk call.
+SUMMARY_INPUT_CHARS = 60000
+SUMMARY_MAX_TOKENS = 500
+
+# Chunks that are short or don't lean on surrounding text ("It", "This", ...)
+# are already self-contained and skip the contextualizer LLM call.
+MIN_CONTEXT_CHUNK_CHARS = 200
+MIN_CONTEXT_PRONOUNS = 2
+PRONOUN_PATTERN = re.compile(r"\b(it|this|these|they|there|that)\b", re.IGNORECASE)
+DANGLING_OPENERS = ("It ", "This ", "These ", "They ")
+
+# Contextualizer calls (CONTEXT_INJECTION=true only) are independent network
+# round-trips, so they run in parallel (bounded for Groq's rate limits) instead of
+# one after another.
+CONTEXT_MAX_CONCURRENCY = int(os.getenv('CONTEXT_MAX_CONCURRENCY', 8))
+CONTEXT_MAX_RETRIES = 3
+CONTEXT_BACKOFF_BASE = 15  # seconds; doubled on every rate-limited retry
+
+# Optional, on top of CONTEXT_INJECTION=true (without it there are no contextualizer
+# calls to batch): send every contextualizer call of a document as ONE Groq Batch API job
+# (OpenAI-compatible JSONL, billed at a discount). Batches finish in minutes, not
+# seconds, so it's opt-in; on failure or timeout we fall back to chain.batch.
+CONTEXT_USE_BATCH_API = os.getenv('CONTEXT_USE_BATCH_API', 'false').lower() == 'true'
+CONTEXT_BATCH_MAX_WAIT = int(os.getenv('CONTEXT_BATCH_MAX_WAIT', 3600))  # seconds
+CONTEXT_BATCH_POLL_MAX = 60  # seconds between status polls, after backoff
+
+# Re-uploading a PDF (or an overlapping one) yields the same (chunk, context) pairs;
+# their generated context is reused instead of asking the LLM again.
+CONTEXT_CACHE_SIZE = 20000
+CONTEXT_CACHE_KEY_CHARS = 4096  # Prefix of the document/block context that goes into the key
+
+
+def _extract_page_range(source, start: int, stop: int) -> str:
+    """Parse worker: text of pages [start, stop) of a PDF given as a path or bytes."""
+    pdf = pymupdf.open(stream=source, filetype="pdf") if isinstance(source, bytes) else pymupdf.open(source)
+    with pdf:
+        return "\n\n".join(pdf[i].get_text() for i in range(start, stop))
+
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Created on the first long PDF. 'spawn': forking a process that runs threads
+    (and holds model weights) is unsafe and copies far more than a parser needs."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_MAX_WORKERS,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def extract_pdf_text(source) -> str:
+    """Full text of a PDF (path or bytes), pages joined by blank lines."""
+    # MuPDF directly: same text as PyMuPDFLoader, without building a
+    # Document + metadata dict per page that we'd throw away after the join
+    pdf = pymupdf.open(stream=source, filetype="pdf") if isinstance(source, bytes) else pymupdf.open(source)
+    with pdf:
+        page_count = pdf.page_count
+        if page_count < PARSE_PARALLEL_MIN_PAGES or PARSE_MAX_WORKERS < 2:
+            return "\n\n".join(page.get_text() for page in pdf)
+
+    step = -(-page_count // PARSE_MAX_WORKERS)
+    starts = range(0, page_count, step)
+    parts = _get_parse_pool().map(
+        _extract_page_range,
+        [source] * len(starts), starts, [min(start + step, page_count) for start in starts]
+    )
+    return "\n\n".join(parts)
+
+
+def needs_context(text: str) -> bool:
+    """
+    Cheap heuristic: does this chunk reference things defined elsewhere?
+    Only consulted when CONTEXT_INJECTION is on.
+    """
+    if len(text) <= MIN_CONTEXT_CHUNK_CHARS:
+        return False
+    if text.lstrip().startswith(DANGLING_OPENERS):
+        return True
+    return len(PRONOUN_PATTERN.findall(text)) >= MIN_CONTEXT_PRONOUNS
+
+class ContextCache:
+    """
+    In-process LRU of hash(chunk + context prefix) -> generated chunk context,
+    with hit/miss counters so the hit rate can be checked in the logs.
+    Filled and read only on the contextualization path (CONTEXT_INJECTION=true).
+    """
+
+    def __init__(self, max_size: int = CONTEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(chunk_content: str, context_str: str) -> str:
+        digest = hashlib.blake2b(chunk_content.encode('utf-8'), digest_size=16)
+        digest.update(b"\x00")
+        digest.update(context_str[:CONTEXT_CACHE_KEY_CHARS].encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
 
 class DocumentProcessorService:
     def __init__(self, contextualizer_llm):
         self.contextualizer_llm = contextualizer_llm
+        # One keep-alive session for PDF downloads: repeat uploads from the same
+        # storage host skip the TCP + TLS handshake
+        self.http = requests.Session()
+        # Concurrent indexing jobs each hold a connection; transient storage errors
+        # (connection resets, 5xx) are retried instead of failing the whole upload
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=DOWNLOAD_POOL_SIZE,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504)),
+        )
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.context_cache = ContextCache()
+        # Stateless once built, so one splitter serves every upload
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            separators=CHUNK_SEPARATORS.get(CHUNK_STRATEGY, CHUNK_SEPARATORS["paragraph"])
+        )
         self.context_prompt = ChatPromptTemplate.from_template(
             """<document>{doc_context}</document>
                Here is a chunk of text: <chunk>{chunk_content}</chunk>
@@ -27,108 +201,85 @@ class DocumentProcessorService:
         )
         self.chain = self.context_prompt | self.contextualizer_llm | StrOutputParser()
 
-    def process_pdf(self, file_url: str, db_id: int, space_id: int) -> List[Document]:
+        self.summary_prompt = ChatPromptTemplate.from_template(
+            """<document>{text}</document>
+               Summarize this document in one compact paragraph (at most """ + str(SUMMARY_MAX_TOKENS) + """ tokens).
+               Mention its subject, main sections and key terms so a reader can place any excerpt of it."""
+        )
+        self.summary_chain = self.summary_prompt | self.contextualizer_llm | StrOutputParser()
+
+    def process_pdf(self, file_url: str, db_id: int, space_id: int, local_path: Optional[str] = None,
+                    pdf_bytes: Optional[bytes] = None) -> List[Document]:
         """
         Downloads and processes PDF with Claude's Contextual Retrieval method.
         Optimized for Groq Rate Limits.
+        local_path: a copy of the same PDF already on disk (e.g. the file that was
+        just uploaded); it is used instead of downloading file_url, and removed after.
+        pdf_bytes: the PDF already in memory (small uploads); parsed from RAM directly.
         """
-        filename = file_url.split('/')[-1].split('?')[0]
-        local_temp_path = self._download_file(file_url)
+        # Stored decoded ("RAG Test.pdf", not "RAG%20Test.pdf") so it matches documents.filename
+        filename = unquote(file_url.split('/')[-1].split('?')[0])
+        local_temp_path = None if pdf_bytes is not None else (local_path or self._download_file(file_url))
 
         try:
-            loader = PyPDFLoader(local_temp_path)
-            pages = loader.load()
-            full_text = "\n\n".join([p.page_content for p in pages])
+            full_text = extract_pdf_text(pdf_bytes if pdf_bytes is not None else local_temp_path)
 
             # 1. Split into raw chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP
-            )
-            raw_docs = text_splitter.create_documents([full_text])
+            raw_docs = self.text_splitter.create_documents([full_text])
+            print(f"Split {len(full_text)} chars into {len(raw_docs)} chunks ({CHUNK_STRATEGY}, {CHUNK_SIZE} chars).")
             
             # 2. Decide Strategy based on Token/Char limit
-            if len(full_text) <= CONTEXT_THRESHOLD_CHARS:
-                # print(f"--- Strategy: Global Context (Size: {len(full_text)} chars) ---")
-                # return self._process_with_global_context(raw_docs, full_text, filename, space_id, file_url, db_id)
-                
-                # FALLBACK STRATEGY: No context injection for small documents to avoid 429 errors
-                print(f"--- Strategy: Skip Context Injection (Size: {len(full_text)} chars) ---")
-                contextualized_docs = []
-                for i, doc in enumerate(raw_docs):
-                    # We pass a simple indicator or empty string as context
-                    # This keeps your 'combined_content' format consistent for the DB
-                    new_doc = self._create_contextual_doc(
-                        doc, 
-                        "", 
-                        filename, 
-                        space_id,
-                        file_url, 
-                        db_id
-                    )
-                    contextualized_docs.append(new_doc)
-                return contextualized_docs
-            else:
-
-                # print(f"--- Strategy: Sliding Window Placeholder (Size: {len(full_text)} chars) ---")
-                # return self._process_with_sliding_window(raw_docs, full_text, filename, space_id, file_url, db_id)
-                
-                # FALLBACK STRATEGY: No context injection for large documents to avoid 429 errors
+            if not CONTEXT_INJECTION:
+                # DEFAULT STRATEGY: No context injection, to avoid Groq 429 errors.
+                # Every chunk still gets the 'Context: ...\n\nContent: ...' format the DB expects.
                 print(f"--- Strategy: Skip Context Injection (Size: {len(full_text)} chars) ---")
-                contextualized_docs = []
-                for i, doc in enumerate(raw_docs):
-                    # We pass a simple indicator or empty string as context
-                    # This keeps your 'combined_content' format consistent for the DB
-                    new_doc = self._create_contextual_doc(
-                        doc, 
-                        "", 
-                        filename, 
-                        space_id, 
-                        file_url, 
-                        db_id
-                    )
-                    contextualized_docs.append(new_doc)
-                return contextualized_docs
+                return [
+                    self._create_contextual_doc(doc, "", filename, space_id, file_url, db_id)
+                    for doc in raw_docs
+                ]
+            if len(full_text) <= CONTEXT_THRESHOLD_CHARS:
+                print(f"--- Strategy: Global Context (Size: {len(full_text)} chars) ---")
+                return self._process_with_global_context(raw_docs, full_text, filename, space_id, file_url, db_id)
+            print(f"--- Strategy: Block Context (Size: {len(full_text)} chars) ---")
+            return self._process_with_block_context(raw_docs, full_text, filename, space_id, file_url, db_id)
 
         finally:
-            if os.path.exists(local_temp_path):
+            if local_temp_path and os.path.exists(local_temp_path):
                 os.remove(local_temp_path)
 
+    def _summarize_document(self, full_text: str) -> str:
+        """
+        One LLM call that condenses the document into a short global context.
+        Falls back to the truncated raw text if the summary call fails.
+        """
+        # Cached too: a fresh summary would differ slightly on every re-upload, and every
+        # chunk's cache key includes it
+        key = ContextCache.key(full_text[:SUMMARY_INPUT_CHARS], "<summary>")
+        cached = self.context_cache.get(key)
+        if cached is not None:
+            return cached
+        try:
+            summary = self.summary_chain.invoke({"text": full_text[:SUMMARY_INPUT_CHARS]})
+            self.context_cache.put(key, summary)
+            return summary
+        except Exception as e:
+            print(f"Document summary failed: {e}. Using truncated text as context.")
+            return full_text[:CONTEXT_THRESHOLD_CHARS]
+
     def _process_with_global_context(self, raw_docs, full_text, filename, space_id, file_url, db_id):
-        """Your original logic: uses the whole (truncated) doc for every chunk."""
-        contextualized_docs = []
-        document_context_str = full_text[:CONTEXT_THRESHOLD_CHARS]
-
-        for i, doc in enumerate(raw_docs):
-            # Mandatory sleep for Groq Free Tier (adjust based on your specific TPM)
-            time.sleep(60) 
-
-            retries = 3
-            success = False
-            while retries > 0 and not success:
-                try:
-                    chunk_context = self.chain.invoke({
-                        "doc_context": document_context_str,
-                        "chunk_content": doc.page_content
-                    })
-                    
-                    new_doc = self._create_contextual_doc(doc, chunk_context, filename, space_id, file_url, db_id)
-                    contextualized_docs.append(new_doc)
-                    print(f"Processed chunk {i + 1}/{len(raw_docs)}...", end='\r')
-                    success = True
-
-                except Exception as e:
-                    success, retries = self._handle_error(e, i, retries, contextualized_docs, doc)
-
-        return contextualized_docs
+        """
+        Your original logic, but every chunk now sees a compact document summary
+        (computed once) instead of the whole truncated document.
+        """
+        document_context_str = self._summarize_document(full_text)
+        jobs = [(doc, document_context_str) for doc in raw_docs]
+        return self._contextualize_chunks(jobs, filename, space_id, file_url, db_id)
 
     def _process_with_block_context(self, raw_docs, full_text, filename, space_id, file_url, db_id):
         """
         Divides the document into 'Big Blocks' that fit Groq's TPM.
         Chunks inside a block only 'see' that block as their context.
         """
-        contextualized_docs = []
-    
         # 1. Group raw_docs into blocks that fit the character limit
         blocks = []
         current_block_docs = []
@@ -150,45 +301,147 @@ class DocumentProcessorService:
 
         print(f"--- Document divided into {len(blocks)} Big Context Blocks ---")
 
-        # 2. Process each block
-        total_processed = 0
-        for block_idx, block_chunks in enumerate(blocks):
-            # Create the context string for this specific block
+        # 2. Every chunk only sees its own block; all blocks go out as one batch
+        jobs = []
+        for block_chunks in blocks:
             block_context_str = "\n\n".join([d.page_content for d in block_chunks])
-        
-            print(f"\nProcessing Block {block_idx + 1}/{len(blocks)} ({len(block_chunks)} chunks)")
-        
-            for i, doc in enumerate(block_chunks):
-                # Groq Sleep: Essential for Free Tier
-                time.sleep(1.5) 
-            
-                retries = 3
-                success = False
-                while retries > 0 and not success:
-                    try:
-                        chunk_context = self.chain.invoke({
-                            "doc_context": block_context_str,
-                            "chunk_content": doc.page_content
-                        })
-                    
-                        new_doc = self._create_contextual_doc(doc, chunk_context, filename, space_id, file_url, db_id)
-                        contextualized_docs.append(new_doc)
-                    
-                        total_processed += 1
-                        print(f"Chunk {total_processed}/{len(raw_docs)} (Block {block_idx+1}) complete...", end='\r')
-                        success = True
-
-                    except Exception as e:
-                        success, retries = self._handle_error(e, total_processed, retries, contextualized_docs, doc)
-
-        return contextualized_docs
+            jobs.extend((doc, block_context_str) for doc in block_chunks)
+        return self._contextualize_chunks(jobs, filename, space_id, file_url, db_id)
+
+    def _contextualize_chunks(self, jobs, filename, space_id, file_url, db_id):
+        """
+        jobs: [(chunk, context string)] in document order. Contexts generated for the
+        same pair before come from context_cache; the other chunks that need context
+        are sent through chain.batch (up to CONTEXT_MAX_CONCURRENCY calls in flight);
+        rate-limited ones are retried with exponential backoff, anything else falls
+        back to the chunk without context. Output order matches jobs.
+        Reached from process_pdf only when CONTEXT_INJECTION is on.
+        """
+        contexts = [""] * len(jobs)
+        keys = {}
+        pending = []
+        for i, (doc, context_str) in enumerate(jobs):
+            if not needs_context(doc.page_content):
+                continue
+            keys[i] = ContextCache.key(doc.page_content, context_str)
+            cached = self.context_cache.get(keys[i])
+            if cached is None:
+                pending.append(i)
+            else:
+                contexts[i] = cached
+        print(f"{len(jobs) - len(keys)}/{len(jobs)} chunks are self-contained (needs_context); no LLM call for them")
+        if keys:
+            print(f"Context cache: {len(keys) - len(pending)}/{len(keys)} chunks reused "
+                  f"(lifetime hits={self.context_cache.hits} misses={self.context_cache.misses})")
+
+        if pending and CONTEXT_USE_BATCH_API:
+            try:
+                for i, context in self._contextualize_with_batch_api(jobs, pending).items():
+                    contexts[i] = context
+                pending = [i for i in pending if not contexts[i]]
+            except Exception as e:
+                print(f"Batch API contextualization failed: {e}. Falling back to direct calls.")
+
+        for attempt in range(CONTEXT_MAX_RETRIES):
+            if not pending:
+                break
+            if attempt:
+                wait_time = CONTEXT_BACKOFF_BASE * 2 ** (attempt - 1) + random.randint(1, 5)
+                print(f"Rate limit hit on {len(pending)} chunks! Sleeping {wait_time}s...")
+                time.sleep(wait_time)
+
+            results = self.chain.batch(
+                [{"doc_context": jobs[i][1], "chunk_content": jobs[i][0].page_content} for i in pending],
+                config={"max_concurrency": CONTEXT_MAX_CONCURRENCY},
+                return_exceptions=True,
+            )
+            rate_limited = []
+            failed = []
+            for i, result in zip(pending, results):
+                if not isinstance(result, Exception):
+                    contexts[i] = result
+                elif self._is_rate_limit(result):
+                    rate_limited.append(i)
+                else:
+                    failed.append((i, result))
+            pending = rate_limited
+            # One line per round, not one per chunk
+            if failed:
+                print(f"Skipping context for {len(failed)} chunks after errors (first: chunk {failed[0][0]}: {failed[0][1]})")
+            print(f"Contextualized {len(jobs) - len(pending)}/{len(jobs)} chunks")
+
+        if pending:
+            print(f"Gave up on context for {len(pending)} rate-limited chunks.")
+
+        for i, key in keys.items():
+            if contexts[i]:
+                self.context_cache.put(key, contexts[i])
+
+        return [
+            self._create_contextual_doc(doc, contexts[i], filename, space_id, file_url, db_id)
+            for i, (doc, _) in enumerate(jobs)
+        ]
+
+    def _contextualize_with_batch_api(self, jobs, indices) -> dict:
+        """
+        Uploads the prompts for jobs[indices] as one JSONL batch (custom_id = job index),
+        polls with exponential backoff until it completes, and returns
+        {job index: context} for every line that succeeded.
+        """
+        from groq import Groq  # ships with langchain-groq
+
+        client = Groq()
+        model = self.contextualizer_llm.model_name
+        lines = []
+        for i in indices:
+            doc, context_str = jobs[i]
+            prompt = self.context_prompt.format(doc_context=context_str, chunk_content=doc.page_content)
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": model, "messages": [{"role": "user", "content": prompt}]},
+            }))
+
+        batch_file = client.files.create(file=("contexts.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        print(f"Submitted {len(lines)} chunks as batch {batch.id}")
+
+        deadline = time.monotonic() + CONTEXT_BATCH_MAX_WAIT
+        delay = 5
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.monotonic() > deadline:
+                client.batches.cancel(batch.id)
+                raise TimeoutError(f"batch {batch.id} still {batch.status} after {CONTEXT_BATCH_MAX_WAIT}s")
+            time.sleep(delay)
+            delay = min(delay * 2, CONTEXT_BATCH_POLL_MAX)
+            batch = client.batches.retrieve(batch.id)
+
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"batch {batch.id} ended as {batch.status}")
+
+        contexts = {}
+        output = client.files.content(batch.output_file_id).read().decode()
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                contexts[int(record["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+        return contexts
 
     def _download_file(self, file_url: str) -> str:
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-            response = requests.get(file_url, stream=True)
-            response.raise_for_status()
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
+            with self.http.get(file_url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                # Straight from the socket to disk in 1 MiB reads (gzip, if any, still undone)
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, temp_file, DOWNLOAD_CHUNK_SIZE)
             return temp_file.name
 
     def _create_contextual_doc(self, doc, context, filename, space_id, file_url, db_id):
@@ -203,14 +456,7 @@ class DocumentProcessorService:
         })
         return new_doc
 
-    def _handle_error(self, e, index, retries, docs_list, original_doc):
+    @staticmethod
+    def _is_rate_limit(e: Exception) -> bool:
         error_msg = str(e)
-        if "429" in error_msg or "rate limit" in error_msg.lower():
-            wait_time = 15 + random.randint(1, 5)
-            print(f"\nRate Limit Hit on chunk {index}! Sleeping {wait_time}s...")
-            time.sleep(wait_time)
-            return False, retries - 1
-        else:
-            print(f"\nError on chunk {index}: {e}. Skipping context.")
-            docs_list.append(original_doc)
-            return True, 0
\ No newline at end of file
+        return "429" in error_msg or "rate limit" in error_msg.lower()
@@ -22,6 +22,22 @@ DB_USER = os.getenv('POSTGRES_USER')
 DB_PASS = os.getenv('POSTGRES_PASSWORD')
 DB_PORT = int(os.getenv('POSTGRES_PORT', 6543))
 
+# Extensions first: pgvector provides the vector type used by document_chunks.
+EXTENSIONS = [
+    "CREATE EXTENSION IF NOT EXISTS vector;"
+]
+
+# Custom types must exist before the tables that use them.
+# CREATE TYPE has no IF NOT EXISTS, hence the duplicate_object guard.
+TYPES = [
+    """
+    DO $$ BEGIN
+        CREATE TYPE msg_role AS ENUM ('user', 'assistant', 'system', 'tool');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$;
+    """
+]
+
 TABLES = {}
 
 # 0. USER TABLE (for FastAPI-Users authentication)
@@ -61,6 +77,7 @@ TABLES['documents'] = (
         filename VARCHAR(255) NOT NULL,
         file_type VARCHAR(50),
         file_url TEXT, 
+        status VARCHAR(20) NOT NULL DEFAULT 'ready',
         uploaded_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (space_id) REFERENCES spaces(id) ON DELETE CASCADE
     )
@@ -99,16 +116,17 @@ TABLES['context_anchors'] = (
 )
 
 # 5. MESSAGES TABLE
-# MySQL CHECK syntax is compatible with Postgres
+# role is the msg_role enum (4 bytes, values enforced by the type) instead of VARCHAR + CHECK
 TABLES['messages'] = (
     """
     CREATE TABLE IF NOT EXISTS messages (
         id SERIAL PRIMARY KEY,
         thread_id INT NOT NULL,
         user_id INT NOT NULL, 
-        role VARCHAR(20) NOT NULL CHECK (role IN ('user', 'assistant', 'system')),
+        role msg_role NOT NULL,
         content TEXT NOT NULL, 
         path TEXT NOT NULL,
+        ancestor_ids INT[],
         parent_message_id INT,
         branch_id INT DEFAULT NULL,
         created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
@@ -118,16 +136,161 @@ TABLES['messages'] = (
     """
 )
 
+# 5a. DOCUMENT CHUNKS (vector store)
+# Written by LangChain's SupabaseVectorStore (advanced_rag.py) and searched by the
+# match_document_chunks / kw_match_document_chunks RPCs. id is the uuid5 from
+# _chunk_ids; metadata carries space_id, db_id (documents.id), source_document, ...
+# embedding is text-embedding-004 (768 dims); rows written since NormalizedEmbeddings
+# are unit-length, older ones may not be, so searches must keep using cosine (<=>).
+TABLES['document_chunks'] = (
+    """
+    CREATE TABLE IF NOT EXISTS document_chunks (
+        id UUID PRIMARY KEY,
+        content TEXT,
+        metadata JSONB,
+        embedding vector(768)
+    )
+    """
+)
+
+# 5b. MIGRATIONS (idempotent upgrades for databases created before a column existed)
+MIGRATIONS = [
+    # ancestor_ids: the materialized path as an int[] (root ... self), filled by the
+    # insert trigger, so history lookups never parse the path string.
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS ancestor_ids INT[];",
+    """
+    UPDATE messages
+    SET ancestor_ids = string_to_array(trim(both '/' from path), '/')::int[]
+    WHERE ancestor_ids IS NULL AND path <> '';
+    """,
+    # role: VARCHAR + CHECK -> msg_role enum (narrower rows on long threads)
+    """
+    DO $$ BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'messages'
+              AND column_name = 'role') = 'character varying' THEN
+            ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_role_check;
+            ALTER TABLE messages ALTER COLUMN role TYPE msg_role USING role::msg_role;
+        END IF;
+    END $$;
+    """,
+    # content: keep large bodies out of line but uncompressed, so reads skip pglz decompression
+    "ALTER TABLE messages ALTER COLUMN content SET STORAGE EXTERNAL;",
+    # status: uploads are indexed in the background ('indexing' -> 'ready' | 'failed')
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'ready';",
+    # (space_id, filename) becomes unique so add_document can upsert. Before the unique
+    # index exists, fold re-uploads into the newest row, moving their thread anchors over.
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_documents_space_filename') THEN
+            CREATE TEMP TABLE doc_dupes ON COMMIT DROP AS
+                SELECT id, max(id) OVER (PARTITION BY space_id, filename) AS keep_id FROM documents;
+            DELETE FROM doc_dupes WHERE id = keep_id;
+            INSERT INTO context_anchors (thread_id, document_id, page_number)
+                SELECT a.thread_id, d.keep_id, a.page_number
+                FROM context_anchors a JOIN doc_dupes d ON a.document_id = d.id
+                ON CONFLICT DO NOTHING;
+            DELETE FROM documents WHERE id IN (SELECT id FROM doc_dupes);
+        END IF;
+    END $$;
+    """
+]
+
 # 6. INDEXES
 # Note: Postgres doesn't use path(20) prefix indexing; it's handled automatically or via B-Tree.
+# No index on path: nothing queries it (history goes through ancestor_ids on the parent
+# row, i.e. the primary key), so a path index would only add upkeep to every insert.
 INDEXES = [
-    "CREATE INDEX IF NOT EXISTS idx_messages_path ON messages (path);",
-    "CREATE INDEX IF NOT EXISTS idx_messages_branching ON messages (thread_id, branch_id);",
+    "DROP INDEX IF EXISTS idx_messages_path;",
+    "DROP INDEX IF EXISTS idx_messages_path_pattern;",
+    "DROP INDEX IF EXISTS idx_messages_thread_path;",
+    # Single-column / short indexes whose columns lead a composite below: every
+    # lookup they served is answered by the composite, and each costs insert-time upkeep.
+    "DROP INDEX IF EXISTS idx_messages_branching;",   # -> idx_messages_thread_branch_id
+    "DROP INDEX IF EXISTS idx_documents_space;",      # -> uq_documents_space_filename
+    "DROP INDEX IF EXISTS idx_documents_space_filename;",  # -> uq_documents_space_filename
+    "DROP INDEX IF EXISTS idx_threads_space;",        # -> idx_threads_space_created
+    # ancestor_ids is only read off the parent row (id = ANY(ancestor_ids) -> primary key);
+    # nothing asks "which messages descend from X?", so no GIN upkeep on every insert
+    "DROP INDEX IF EXISTS idx_messages_ancestor_ids;",
+    # Partial index over fork-start rows only (branch_id = id), used by the
+    # per-message fork previews (FORKS_LATERAL in database_manager.py)
+    "CREATE INDEX IF NOT EXISTS idx_messages_fork_starts ON messages (thread_id, parent_message_id) WHERE branch_id = id;",
     "CREATE INDEX IF NOT EXISTS idx_anchors_doc_page ON context_anchors (document_id, page_number);",
-    "CREATE INDEX IF NOT EXISTS idx_documents_space ON documents (space_id);",
-    "CREATE INDEX IF NOT EXISTS idx_threads_space ON threads (space_id);"
+    # Postgres doesn't index foreign keys by itself (InnoDB does). Without this, the
+    # ON DELETE SET NULL on parent_message_id scans messages once per deleted row,
+    # so deleting a thread is quadratic in its length; it also backs child lookups.
+    "CREATE INDEX IF NOT EXISTS idx_messages_parent ON messages (parent_message_id);",
+    # Unique: the ON CONFLICT target of add_document, and the filename lookup index
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_documents_space_filename ON documents (space_id, filename);",
+    # Composite indexes matching each WHERE + ORDER BY in database_manager.py,
+    # so those reads are ordered range scans instead of scan + sort.
+    "CREATE INDEX IF NOT EXISTS idx_threads_space_created ON threads (space_id, created_at DESC);",       # get_threads_for_space
+    "CREATE INDEX IF NOT EXISTS idx_threads_creator_space ON threads (creator_user_id, space_id, id DESC);", # per-user thread lists
+    "CREATE INDEX IF NOT EXISTS idx_documents_space_uploaded ON documents (space_id, uploaded_at DESC);", # get_documents_for_space
+    "CREATE INDEX IF NOT EXISTS idx_messages_thread_branch_id ON messages (thread_id, branch_id, id DESC);", # get_last_message_id
+    "CREATE INDEX IF NOT EXISTS idx_messages_branch_created ON messages (branch_id, created_at);",         # get_branch_messages_only
+    # No ANN index on embedding: match_document_chunks filters by space, and pgvector
+    # applies that filter AFTER an HNSW walk of only hnsw.ef_search candidates, so small
+    # spaces would silently get few or no chunks. The exact scan (narrowed by the GIN
+    # index below) keeps full recall; revisit with per-space partial indexes or
+    # hnsw.iterative_scan (pgvector >= 0.8) set inside the RPC.
+    "DROP INDEX IF EXISTS idx_document_chunks_embedding_hnsw;",
+    # metadata @> '{"space_id": N}' (the RPC filter) and per-document chunk lookups
+    "CREATE INDEX IF NOT EXISTS idx_document_chunks_metadata ON document_chunks USING gin (metadata jsonb_path_ops);"
+]
+
+# 7. TRIGGERS
+# Fills in a message's materialized path and branch id inside the INSERT itself,
+# so the application never needs a follow-up UPDATE once the id is known.
+# - path: parent path + own id + '/' (only when the caller didn't supply one)
+# - ancestor_ids: parent's ancestor_ids + own id (same rule)
+# - branch_id = -1: fork start, the Branch ID becomes the message's OWN ID
+# - branch_id NULL: inherit the parent's branch (NULL = main thread)
+TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION messages_fill_path() RETURNS trigger AS $$
+    DECLARE
+        parent_path TEXT;
+        parent_ancestors INT[];
+        parent_branch INT;
+    BEGIN
+        IF NEW.parent_message_id IS NOT NULL THEN
+            SELECT path, ancestor_ids, branch_id INTO parent_path, parent_ancestors, parent_branch
+            FROM messages WHERE id = NEW.parent_message_id;
+        END IF;
+
+        IF NEW.path IS NULL OR NEW.path = '' THEN
+            NEW.path := COALESCE(parent_path, '') || NEW.id::text || '/';
+        END IF;
+
+        IF NEW.ancestor_ids IS NULL THEN
+            NEW.ancestor_ids := COALESCE(parent_ancestors, '{}'::int[]) || NEW.id;
+        END IF;
+
+        IF NEW.branch_id = -1 THEN
+            NEW.branch_id := NEW.id;
+        ELSIF NEW.branch_id IS NULL THEN
+            NEW.branch_id := parent_branch;
+        END IF;
+
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    "DROP TRIGGER IF EXISTS trg_messages_fill_path ON messages;",
+    """
+    CREATE TRIGGER trg_messages_fill_path
+    BEFORE INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION messages_fill_path();
+    """
 ]
 
+def build_schema_script() -> str:
+    """All DDL in dependency order as one multi-statement SQL script."""
+    statements = EXTENSIONS + TYPES + list(TABLES.values()) + MIGRATIONS + INDEXES + TRIGGERS
+    return "\n".join(stmt.strip().rstrip(';') + ';' for stmt in statements)
+
 def create_tables():
     conn = None
     try:
@@ -141,15 +304,10 @@ def create_tables():
         )
         cur = conn.cursor()
 
-        # 1. Create Tables
-        for name, ddl in TABLES.items():
-            logger.info(f"Processing table {name}...")
-            cur.execute(ddl)
-
-        # 2. Create Indexes
-        logger.info("Creating indexes...")
-        for idx_ddl in INDEXES:
-            cur.execute(idx_ddl)
+        # Extensions -> Types -> Tables -> Migrations -> Indexes -> Triggers, sent as ONE script:
+        # a single round-trip, and one transaction (nothing is applied if any step fails).
+        logger.info(f"Applying schema: {len(TABLES)} tables, {len(INDEXES)} indexes, {len(TRIGGERS)} trigger statements...")
+        cur.execute(build_schema_script())
 
         conn.commit()
         cur.close()
@@ -3,7 +3,8 @@ from typing import Optional
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, IntegerIDMixin
 from fastapi_users.authentication import AuthenticationBackend, BearerTransport, JWTStrategy
-from db import User, get_user_db
+from db import User, get_user_db, get_async_session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 import os
 from dotenv import load_dotenv
@@ -70,4 +71,18 @@ auth_backend = AuthenticationBackend(
 )
 
 fastapi_users = FastAPIUsers[User, int](get_user_manager, [auth_backend])
-current_active_user = fastapi_users.current_user(active=True)
\ No newline at end of file
+current_active_user = fastapi_users.current_user(active=True)
+
+
+async def current_active_user_released(
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session),
+) -> User:
+    """
+    Same as current_active_user, but hands the auth session's pooled connection back
+    right after the user is loaded. Use it on endpoints that go on to do long RAG/LLM
+    work; otherwise the connection stays checked out until the response is sent.
+    (Same request => same cached session instance as the one used for the lookup.)
+    """
+    await session.close()
+    return user
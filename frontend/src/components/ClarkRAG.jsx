@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { cn } from './lib/utils';
-import { apiFetch } from '../utils/api';
+import { apiFetch, apiStream } from '../utils/api';
 
 // Component Imports
 import { Sidebar } from './sections/Sidebar';
@@ -98,24 +98,34 @@ export default function ClarkRAG() {
     setIsChatLoading(true);
 
     try {
-        const res = await apiFetch(`/api/chat?space_id=${spaceId}`, {
-            method: 'POST',
-            body: JSON.stringify({
-                text,
-                thread_id: generalThreadId
-            })
+        // Tokens are shown as they are generated; the last message is the one being written
+        let started = false;
+        const data = await apiStream(`/api/chat/stream?space_id=${spaceId}`, {
+            text,
+            thread_id: generalThreadId
+        }, (token) => {
+            if (!started) {
+                started = true;
+                setIsChatLoading(false);
+                setMessages(prev => [...prev, { role: 'assistant', content: token }]);
+                return;
+            }
+            setMessages(prev => {
+                const last = prev[prev.length - 1];
+                return [...prev.slice(0, -1), { ...last, content: last.content + token }];
+            });
         });
-        const data = await res.json();
 
         if (data.thread_id) {
             setGeneralThreadId(data.thread_id);
         }
 
-        setMessages(prev => [...prev, {
+        const finalMessage = {
             role: 'assistant',
             content: data.response,
             source: data.source
-        }]);
+        };
+        setMessages(prev => started ? [...prev.slice(0, -1), finalMessage] : [...prev, finalMessage]);
     } catch (err) {
         setMessages(prev => [...prev, { role: 'assistant', content: "Error: Could not reach the server." }]);
     } finally {
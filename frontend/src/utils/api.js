@@ -80,6 +80,42 @@ export const apiPost = (url, data) =>
     body: data instanceof FormData ? data : JSON.stringify(data),
   });
 
+/**
+ * POST a JSON body to a Server-Sent Events endpoint (e.g. /api/chat/stream).
+ * Calls onToken(text) for every {"token"} event and resolves with the final
+ * {"done": true, ...} event; an {"error"} event rejects.
+ */
+export const apiStream = async (url, data, onToken) => {
+  const res = await apiFetch(url, {
+    method: 'POST',
+    body: JSON.stringify(data),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`Stream request failed: ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line; keep a trailing partial event buffered
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const event of events) {
+      if (!event.startsWith('data: ')) continue;
+      const payload = JSON.parse(event.slice(6));
+      if (payload.error) throw new Error(payload.error);
+      if (payload.done) return payload;
+      onToken(payload.token);
+    }
+  }
+  throw new Error('Stream ended before the answer was complete');
+};
+
 /**
  * Shorthand for PUT requests
  */